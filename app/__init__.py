@@ -3,17 +3,23 @@ Feeta Backend Application Factory
 Clean, modular Flask application
 """
 import logging
-from flask import Flask
-from flask_cors import CORS
+from flask import Flask, Response, request
 from app.config import Config
+from app.utils.json_provider import OrjsonProvider
+from app.utils.log_queue import configure_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (records are written out by a background thread)
+configure_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Load balancer probes hit /health constantly; serialize the body once
+_HEALTH_BODY = b'{"status":"healthy","service":"feeta-backend"}'
+
+# CORS is a fixed origin allow-list, so headers are written directly
+_CORS_ORIGINS = frozenset(['http://localhost:3000', 'https://localhost:3000', 'http://127.0.0.1:3000'])
+_CORS_ALLOW_METHODS = 'GET, HEAD, POST, PUT, PATCH, DELETE, OPTIONS'
+_CORS_ALLOW_HEADERS = 'Content-Type, Authorization'
+
 
 def create_app():
     """Application factory pattern"""
@@ -24,9 +30,26 @@ def create_app():
     
     # Create Flask app
     app = Flask(__name__)
+    # Match "/projects/" and "/projects" alike instead of answering with a 301
+    app.url_map.strict_slashes = False
     app.config.from_object(Config)
+    app.json = OrjsonProvider(app)  # C-accelerated jsonify
+    app.json.compact = True
+    app.json.sort_keys = False
     app.secret_key = Config.SECRET_KEY  # Required for session
     
+    # Keep OAuth session state server-side when Redis is available
+    from app.database.redis_client import get_redis
+    redis_client = get_redis()
+    if redis_client is not None:
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_client
+        app.config['SESSION_USE_SIGNER'] = True
+        app.config['SESSION_PERMANENT'] = False
+        Session(app)
+        logger.info("✅ Server-side sessions enabled (Redis)")
+    
     # Validate configuration
     try:
         Config.validate()
@@ -35,12 +58,25 @@ def create_app():
         raise
     
     # Setup CORS
-    CORS(app, 
-         supports_credentials=True,
-         origins=['http://localhost:3000', 'https://localhost:3000', 'http://127.0.0.1:3000'],
-         allow_headers=['Content-Type', 'Authorization'])
+    @app.after_request
+    def add_cors_headers(response):
+        response.vary.add('Origin')
+        origin = request.headers.get('Origin')
+        if origin in _CORS_ORIGINS:
+            headers = response.headers
+            headers['Access-Control-Allow-Origin'] = origin
+            headers['Access-Control-Allow-Credentials'] = 'true'
+            if request.method == 'OPTIONS':
+                headers['Access-Control-Allow-Methods'] = _CORS_ALLOW_METHODS
+                headers['Access-Control-Allow-Headers'] = _CORS_ALLOW_HEADERS
+        return response
+    
+    # Answer preflights for any path without going through blueprint dispatch
+    @app.route('/<path:_>', methods=['OPTIONS'])
+    def cors_preflight(_):
+        return Response(status=204)
     
-    logger.info(f"✅ CORS enabled for: {Config.FRONTEND_URL}")
+    logger.info(f"✅ CORS enabled for: {', '.join(sorted(_CORS_ORIGINS))}")
     
     # Initialize database
     from app.database.mongodb import init_db
@@ -63,9 +99,11 @@ def create_app():
     logger.info("✅ API routes registered")
     
     # Health check endpoint
-    @app.route('/health')
+    @app.route('/health', methods=['GET', 'HEAD'])
     def health_check():
-        return {'status': 'healthy', 'service': 'feeta-backend'}, 200
+        if request.method == 'HEAD':
+            return Response(status=200)
+        return Response(_HEALTH_BODY, status=200, mimetype='application/json')
     
     logger.info("="*80)
     logger.info("✨ Feeta Backend Ready!")
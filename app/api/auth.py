@@ -1,28 +1,58 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-from bson.objectid import ObjectId
+from werkzeug.security import check_password_hash
+from datetime import datetime
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 import jwt
-import os
+import logging
+import time
+from app.database.mongodb import get_user_by_id_cached
+from app.utils.json_provider import ok_response
+from app.utils.jwt_cache import JWT_SECRET, extract_bearer, verify_jwt_cached
 
+logger = logging.getLogger(__name__)
 auth_bp = Blueprint('auth', __name__)
-JWT_SECRET = os.getenv('FLASK_SECRET', 'change_this_secret')
+
+# Module-level PyJWT instance reused for every token we issue
+_jwt = jwt.PyJWT()
+
+# Issued tokens are valid for 30 days; exp is set as a plain epoch int
+TOKEN_TTL_SECONDS = 30 * 86400
+
+# argon2id tuned for interactive logins (OWASP minimum: 19 MiB, t=2, p=1)
+_ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
 
 users_collection = None
 
 
 def get_users_collection():
-    """Get users collection (lazy initialization)"""
+    """Get users collection (lazy initialization, indexes are created by init_db)"""
     global users_collection
     if users_collection is None:
         from app.database.mongodb import db
         users_collection = db['users']
-        users_collection.create_index([("email", 1)], unique=True)
     return users_collection
 
+
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash.
+
+    Returns (valid, needs_rehash). Legacy werkzeug hashes (pbkdf2:/scrypt:)
+    are still accepted and always flagged for rehashing to argon2id.
+    """
+    if stored_hash.startswith("$argon2"):
+        try:
+            _ph.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, _ph.check_needs_rehash(stored_hash)
+    
+    valid = check_password_hash(stored_hash, password)
+    return valid, valid
+
 @auth_bp.route("/register", methods=["POST"])
 def register():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     email = data.get("email")
     password = data.get("password")
     name = data.get("name")
@@ -31,12 +61,12 @@ def register():
         return jsonify({"error": "Email and password required"}), 400
     
     collection = get_users_collection()
-    if collection.find_one({"email": email}):
+    if collection.find_one({"email": email}, {"_id": 1}):
         return jsonify({"error": "Email already exists"}), 400
     
     user = {
         "email": email,
-        "password": generate_password_hash(password),
+        "password": _ph.hash(password),
         "name": name or email.split("@")[0],
         "created_at": datetime.utcnow()
     }
@@ -44,10 +74,10 @@ def register():
     result = collection.insert_one(user)
     user_id = str(result.inserted_id)
     
-    token = jwt.encode({
+    token = _jwt.encode({
         "user_id": user_id,
         "email": email,
-        "exp": datetime.utcnow() + timedelta(days=30)
+        "exp": int(time.time()) + TOKEN_TTL_SECONDS
     }, JWT_SECRET, algorithm="HS256")
     
     return jsonify({
@@ -58,7 +88,7 @@ def register():
 
 @auth_bp.route("/login", methods=["POST"])
 def login():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     email = data.get("email")
     password = data.get("password")
     
@@ -66,16 +96,24 @@ def login():
         return jsonify({"error": "Email and password required"}), 400
     
     collection = get_users_collection()
-    user = collection.find_one({"email": email})
-    if not user or not check_password_hash(user["password"], password):
+    user = collection.find_one({"email": email}, {"password": 1, "name": 1})
+    if not user:
         return jsonify({"error": "Invalid credentials"}), 401
     
+    valid, needs_rehash = verify_password(user["password"], password)
+    if not valid:
+        return jsonify({"error": "Invalid credentials"}), 401
+    
+    # Upgrade legacy or outdated hashes while we have the plaintext
+    if needs_rehash:
+        collection.update_one({"_id": user["_id"]}, {"$set": {"password": _ph.hash(password)}})
+    
     user_id = str(user["_id"])
     
-    token = jwt.encode({
+    token = _jwt.encode({
         "user_id": user_id,
         "email": email,
-        "exp": datetime.utcnow() + timedelta(days=30)
+        "exp": int(time.time()) + TOKEN_TTL_SECONDS
     }, JWT_SECRET, algorithm="HS256")
     
     return jsonify({
@@ -86,25 +124,25 @@ def login():
 
 @auth_bp.route("/logout", methods=["POST"])
 def logout():
-    return jsonify({"ok": True})
+    return ok_response()
 
 @auth_bp.route("/me", methods=["GET"])
 def get_current_user():
-    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    token = extract_bearer(request)
     if not token:
         return jsonify({"authenticated": False}), 401
     
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        payload = verify_jwt_cached(token)
         user_id = payload['user_id']
         
-        collection = get_users_collection()
-        user = collection.find_one({"_id": ObjectId(user_id)})
+        user = get_user_by_id_cached(user_id, payload['_oid'])
         if not user:
             return jsonify({"authenticated": False}), 401
         
         has_github = bool(user.get("github_token"))
-        print(f"User {user['email']} - GitHub token exists: {has_github}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("User %s - GitHub token exists: %s", user['email'], has_github)
         
         return jsonify({
             "authenticated": True,
@@ -1,23 +1,51 @@
-﻿import requests
-from flask import Blueprint, request, jsonify, redirect, session
+﻿from flask import Blueprint, request, jsonify, redirect, session, current_app, g
 from datetime import datetime
 from app.config import Config
 from bson.objectid import ObjectId
 import logging
+import hashlib
+import secrets
+import threading
 import jwt
-import os
+import orjson
+from urllib.parse import quote
+from cachetools import TTLCache
+from app.database.mongodb import get_user_by_id_cached, invalidate_user_cache
+from app.utils.background import run_in_background
+from app.utils.http import create_session, DEFAULT_TIMEOUT
+from app.utils.jwt_cache import authenticate_request, extract_bearer, verify_jwt_cached
 
 logger = logging.getLogger(__name__)
 github_bp = Blueprint('github', __name__)
 users_collection = None
-JWT_SECRET = os.getenv('FLASK_SECRET', 'change_this_secret')
+
+# Shared keep-alive session for github.com / api.github.com
+_gh = create_session(pool_connections=10, pool_maxsize=50)
+
+# Result of probing api.github.com/user per GitHub token, so polling
+# check_connection doesn't hit GitHub on every call
+_token_probe_cache = TTLCache(maxsize=5000, ttl=120)
+_token_probe_lock = threading.Lock()
+
+# (ETag, encoded body) of the last /user/repos response per user
+GITHUB_REPOS_URL = "https://api.github.com/user/repos?per_page=100&sort=updated"
+_repos_cache = TTLCache(maxsize=5000, ttl=300)
+_repos_cache_lock = threading.Lock()
+
+# OAuth authorize URL; only the CSRF state changes per install
+_AUTH_URL_TMPL = (
+    "https://github.com/login/oauth/authorize?"
+    f"client_id={quote(Config.GITHUB_CLIENT_ID or '', safe='')}&"
+    "scope=repo&"
+    f"redirect_uri={quote(f'{Config.BACKEND_URL}/github/callback', safe='')}&"
+    "state={state}"
+)
 
 def get_users_collection():
     global users_collection
     if users_collection is None:
         from app.database.mongodb import db
         users_collection = db['users']
-        users_collection.create_index([("email", 1)], unique=True)
     return users_collection
 
 def save_github_token(user_id, access_token, username, github_user_id):
@@ -33,12 +61,61 @@ def save_github_token(user_id, access_token, username, github_user_id):
                 "updated_at": datetime.utcnow()
             }}
         )
-        logger.info(f"GitHub token saved for user {user_id}")
+        invalidate_user_cache(user_id)
+        logger.info("GitHub token saved for user %s", user_id)
         return True
     except Exception as e:
-        logger.error(f"Error saving GitHub token: {str(e)}")
+        logger.error("Error saving GitHub token: %s", e)
         return False
 
+def fetch_user_repos(user_id, github_token):
+    """Fetch the user's repositories as encoded JSON.
+
+    The last response is kept per user with its ETag and revalidated with
+    If-None-Match; GitHub answers 304s with no body and doesn't count them
+    against the rate limit.
+    """
+    with _repos_cache_lock:
+        cached = _repos_cache.get(user_id)
+    
+    headers = {'Authorization': f'token {github_token}'}
+    if cached:
+        headers['If-None-Match'] = cached[0]
+    
+    response = _gh.get(GITHUB_REPOS_URL, headers=headers, timeout=DEFAULT_TIMEOUT)
+    if response.status_code == 304 and cached:
+        return cached[1]
+    
+    repos = orjson.loads(response.content)
+    formatted_repos = [{
+        'id': repo['id'],
+        'name': repo['name'],
+        'full_name': repo['full_name'],
+        'description': repo.get('description'),
+        'language': repo.get('language'),
+        'private': repo['private'],
+        'updated_at': repo['updated_at']
+    } for repo in repos if isinstance(repo, dict)]
+    body = orjson.dumps(formatted_repos)
+    
+    etag = response.headers.get('ETag')
+    if response.status_code == 200 and etag:
+        with _repos_cache_lock:
+            _repos_cache[user_id] = (etag, body)
+    return body
+
+# OAuth entry points carry their token in the query string / session, and
+# check_connection reports failures as {"connected": False} instead of 401
+_PUBLIC_ENDPOINTS = {'github.github_install', 'github.github_callback', 'github.check_connection'}
+
+
+@github_bp.before_request
+def require_jwt():
+    """Verify the bearer token once per request and expose g.user_id"""
+    if request.method == 'OPTIONS' or request.endpoint in _PUBLIC_ENDPOINTS:
+        return None
+    return authenticate_request()
+
 @github_bp.route("/install", methods=["GET"])
 def github_install():
     logger.info("=== GITHUB INSTALL INITIATED ===")
@@ -50,28 +127,20 @@ def github_install():
     
     try:
         # Verify JWT and extract user_id
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        payload = verify_jwt_cached(token)
         user_id = payload['user_id']
         
         # Store user_id in session for callback
         session['pending_github_user_id'] = user_id
-        session['auth_token'] = token
         
-        logger.info(f"GitHub OAuth initiated for user: {user_id}")
+        logger.info("GitHub OAuth initiated for user: %s", user_id)
         
-        import secrets
-        state = secrets.token_hex(8)
+        state = secrets.token_urlsafe(16)
         session['github_state'] = state
         
-        auth_url = (
-            f"https://github.com/login/oauth/authorize?"
-            f"client_id={Config.GITHUB_CLIENT_ID}&"
-            f"scope=repo&"
-            f"state={state}&"
-            f"redirect_uri={Config.BACKEND_URL}/github/callback"
-        )
+        auth_url = _AUTH_URL_TMPL.format(state=state)
         
-        logger.info(f"Redirect to: {auth_url}")
+        logger.info("Redirect to: %s", auth_url)
         return redirect(auth_url)
         
     except jwt.ExpiredSignatureError:
@@ -88,7 +157,7 @@ def github_callback():
     state = request.args.get("state")
     
     if error:
-        logger.error(f"OAuth error: {error}")
+        logger.error("OAuth error: %s", error)
         return redirect(f"{Config.FRONTEND_URL}/github?error={error}")
     
     if not code:
@@ -106,7 +175,7 @@ def github_callback():
         logger.error("No user_id in session")
         return redirect(f"{Config.FRONTEND_URL}/github?error=session_expired")
     
-    logger.info(f"Authorization code received for user: {user_id}")
+    logger.info("Authorization code received for user: %s", user_id)
     
     try:
         token_url = "https://github.com/login/oauth/access_token"
@@ -118,12 +187,12 @@ def github_callback():
         headers = {'Accept': 'application/json'}
         
         logger.info("Exchanging code for token...")
-        response = requests.post(token_url, json=data, headers=headers)
-        result = response.json()
+        response = _gh.post(token_url, json=data, headers=headers, timeout=DEFAULT_TIMEOUT)
+        result = orjson.loads(response.content)
         
         if 'access_token' not in result:
             error_msg = result.get('error', 'unknown_error')
-            logger.error(f"Token exchange failed: {error_msg}")
+            logger.error("Token exchange failed: %s", error_msg)
             return redirect(f"{Config.FRONTEND_URL}/github?error={error_msg}")
         
         access_token = result['access_token']
@@ -131,101 +200,84 @@ def github_callback():
         # Get GitHub user info
         user_url = "https://api.github.com/user"
         user_headers = {'Authorization': f'token {access_token}'}
-        user_response = requests.get(user_url, headers=user_headers)
-        user_data = user_response.json()
+        user_response = _gh.get(user_url, headers=user_headers, timeout=DEFAULT_TIMEOUT)
+        user_data = orjson.loads(user_response.content)
         
         username = user_data.get('login')
         github_user_id = user_data.get('id')
         
-        # Save token to the AUTHENTICATED user (not GitHub user_id)
-        save_github_token(user_id, access_token, username, github_user_id)
+        # Save token to the AUTHENTICATED user (not GitHub user_id) while
+        # warming the repos cache so the dashboard's first get_repos is instant
+        save_future = run_in_background(save_github_token, user_id, access_token, username, github_user_id)
+        run_in_background(fetch_user_repos, user_id, access_token)
         
         # Clear session
         session.pop('pending_github_user_id', None)
         session.pop('github_state', None)
         
-        logger.info("GitHub token exchange successful!")
-        logger.info(f"Username: {username}")
-        logger.info(f"Saved to user: {user_id}")
+        logger.info("GitHub token exchange successful! Username: %s, saved to user: %s", username, user_id)
+        
+        # Only the DB write has to land before the frontend reloads the user
+        save_future.result()
         
         # Redirect back to demodash page with success message
         return redirect(f"{Config.FRONTEND_URL}/demodash?github_connected=true")
         
     except Exception as e:
-        logger.error(f"Exception during token exchange: {str(e)}")
+        logger.error("Exception during token exchange: %s", e)
         return redirect(f"{Config.FRONTEND_URL}/github?error=exchange_failed")
 
 @github_bp.route("/api/repos", methods=["GET"])
 def get_repos():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
+    user_id = g.user_id
     
     try:
-        # Get user's JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
-        
         # Get user's GitHub token from database
-        collection = get_users_collection()
-        user = collection.find_one({"_id": ObjectId(user_id)})
+        user = get_user_by_id_cached(user_id, g.user_oid)
         
         if not user or not user.get('github_token'):
             return jsonify({"error": "GitHub not connected"}), 401
         
-        github_token = user['github_token']
-        headers = {'Authorization': f'token {github_token}'}
-        url = "https://api.github.com/user/repos?per_page=100&sort=updated"
-        
-        response = requests.get(url, headers=headers)
-        repos = response.json()
-        
-        formatted_repos = [{
-            'id': repo['id'],
-            'name': repo['name'],
-            'full_name': repo['full_name'],
-            'description': repo.get('description'),
-            'language': repo.get('language'),
-            'private': repo['private'],
-            'updated_at': repo['updated_at']
-        } for repo in repos if isinstance(repo, dict)]
-        
-        return jsonify(formatted_repos)
+        body = fetch_user_repos(user_id, user['github_token'])
+        return current_app.response_class(body, mimetype='application/json')
         
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
     except Exception as e:
-        logger.error(f"Error fetching repos: {str(e)}")
+        logger.error("Error fetching repos: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @github_bp.route("/api/check_connection", methods=["GET"])
 def check_connection():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
+    token = extract_bearer(request)
+    if not token:
         return jsonify({"connected": False})
     
     try:
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        payload = verify_jwt_cached(token)
         user_id = payload['user_id']
         
-        collection = get_users_collection()
-        user = collection.find_one({"_id": ObjectId(user_id)})
+        user = get_user_by_id_cached(user_id, payload['_oid'])
         
         if user and user.get('github_token'):
             # Verify token is still valid
             github_token = user['github_token']
-            headers = {'Authorization': f'token {github_token}'}
-            response = requests.get("https://api.github.com/user", headers=headers)
+            probe_key = hashlib.sha256(github_token.encode()).digest()[:16]
+            with _token_probe_lock:
+                valid = _token_probe_cache.get(probe_key)
+            
+            if valid is None:
+                headers = {'Authorization': f'token {github_token}'}
+                response = _gh.get("https://api.github.com/user", headers=headers, timeout=DEFAULT_TIMEOUT)
+                valid = response.status_code == 200
+                # Only remember definitive answers, not rate limits or outages
+                if response.status_code in (200, 401):
+                    with _token_probe_lock:
+                        _token_probe_cache[probe_key] = valid
             
-            if response.status_code == 200:
+            if valid:
                 return jsonify({"connected": True})
         
         return jsonify({"connected": False})
         
     except Exception as e:
-        logger.error(f"Error checking connection: {str(e)}")
+        logger.error("Error checking connection: %s", e)
         return jsonify({"connected": False})
@@ -2,242 +2,216 @@
 Project and Message API Routes
 Handles CRUD operations for projects and messages
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, current_app, stream_with_context
 import logging
-import jwt
-import os
+from bson import ObjectId
 from app.database.mongodb import (
-    create_project, get_user_projects, update_project, delete_project,
-    save_message, get_project_messages, get_database_stats,
+    create_project, get_user_projects,
+    update_project, delete_project,
+    save_message, get_project_messages_batch, iter_project_messages, get_database_stats,
     create_tasks, get_project_tasks, update_task, delete_task
 )
+from app.utils.errors import register_error_handlers
+from app.utils.json_provider import ok_response
+from app.utils.jwt_cache import authenticate_request
 
 logger = logging.getLogger(__name__)
-JWT_SECRET = os.getenv('FLASK_SECRET', 'change_this_secret')
 
 project_bp = Blueprint('project', __name__)
+register_error_handlers(project_bp)
+
+# Fields clients may not overwrite through the update routes
+_PROJECT_IMMUTABLE = frozenset({'_id', 'id', 'user_id', 'created_at'})
+_TASK_IMMUTABLE = frozenset({'_id', 'id', 'project_id', 'created_at', 'created_from'})
+
+# Upper bound on project ids per batched messages request
+MAX_BATCH_PROJECTS = 50
+
+# Endpoints reachable without a bearer token
+_PUBLIC_ENDPOINTS = {'project.database_stats'}
+
+
+@project_bp.before_request
+def require_jwt():
+    """Verify the bearer token once per request and expose g.user_id"""
+    if request.method == 'OPTIONS' or request.endpoint in _PUBLIC_ENDPOINTS:
+        return None
+    return authenticate_request()
 
 
 @project_bp.route("/projects", methods=["GET"])
 def get_projects():
     """Get all projects for the authenticated user"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Get user_id from JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
-        
-        logger.info(f"📂 Fetching projects for user: {user_id}")
-        
-        projects = get_user_projects(user_id)
-        
-        return jsonify({
-            "ok": True,
-            "projects": projects
-        })
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error fetching projects: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    user_id = g.user_id
+    
+    # Optional pagination
+    limit = request.args.get('limit', type=int)
+    skip = request.args.get('skip', 0, type=int)
+    
+    logger.info(f"📂 Fetching projects for user: {user_id}")
+    
+    projects = get_user_projects(user_id, limit=limit, skip=skip)
+    
+    return jsonify({
+        "ok": True,
+        "projects": projects
+    })
 
 
 @project_bp.route("/projects", methods=["POST"])
 def create_new_project():
     """Create a new project"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Get user_id from JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
-        
-        data = request.get_json()
-        name = data.get('name')
-        repo_data = data.get('repo')
-        
-        if not name:
-            return jsonify({"error": "name required"}), 400
-        
-        logger.info(f"📝 Creating project '{name}' for user {user_id}")
-        
-        project = create_project(user_id, name, repo_data)
-        
-        if project:
-            return jsonify({
-                "ok": True,
-                "project": project
-            })
-        else:
-            return jsonify({"error": "Failed to create project"}), 500
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error creating project: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    user_id = g.user_id
+    
+    data = request.get_json(silent=True) or {}
+    name = data.get('name')
+    repo_data = data.get('repo')
+    
+    if not name:
+        return jsonify({"error": "name required"}), 400
+    
+    logger.info(f"📝 Creating project '{name}' for user {user_id}")
+    
+    project = create_project(user_id, name, repo_data)
+    
+    if project:
+        return jsonify({
+            "ok": True,
+            "project": project
+        })
+    else:
+        return jsonify({"error": "Failed to create project"}), 500
 
 
 @project_bp.route("/projects/<project_id>", methods=["PUT"])
 def update_project_route(project_id):
     """Update a project"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        data = request.get_json()
-        
-        # Remove fields that shouldn't be updated directly
-        updates = {k: v for k, v in data.items() if k not in ['_id', 'id', 'user_id', 'created_at']}
-        
-        logger.info(f"✏️ Updating project {project_id}")
-        
-        success = update_project(project_id, updates)
-        
-        if success:
-            return jsonify({"ok": True})
-        else:
-            return jsonify({"error": "Failed to update project"}), 500
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error updating project: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    data = request.get_json(silent=True) or {}
+    
+    # Remove fields that shouldn't be updated directly
+    updates = {k: v for k, v in data.items() if k not in _PROJECT_IMMUTABLE}
+    
+    logger.info(f"✏️ Updating project {project_id}")
+    
+    success = update_project(project_id, updates)
+    
+    if success:
+        return ok_response()
+    else:
+        return jsonify({"error": "Failed to update project"}), 500
 
 
 @project_bp.route("/projects/<project_id>", methods=["DELETE"])
 def delete_project_route(project_id):
     """Delete a project"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        logger.info(f"🗑️ Deleting project {project_id}")
-        
-        success = delete_project(project_id)
-        
-        if success:
-            return jsonify({"ok": True})
-        else:
-            return jsonify({"error": "Failed to delete project"}), 404
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error deleting project: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    logger.info(f"🗑️ Deleting project {project_id}")
+    
+    success = delete_project(project_id)
+    
+    if success:
+        return ok_response()
+    else:
+        return jsonify({"error": "Failed to delete project"}), 404
 
 
 @project_bp.route("/projects/<project_id>/messages", methods=["GET"])
 def get_messages(project_id):
-    """Get all messages for a project"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        logger.info(f"💬 Fetching messages for project {project_id}")
-        
-        messages = get_project_messages(project_id)
-        
-        return jsonify({
-            "ok": True,
-            "messages": messages
-        })
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error fetching messages: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    """Get messages for a project, streamed as they come off the cursor.
+
+    ?limit=N returns the latest N messages; pass the id of the oldest
+    message in a page as ?before= to fetch the page before it.
+    ?include_data=false leaves out the per-message data payload.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    include_data = request.args.get('include_data', 'true').lower() != 'false'
+    before = request.args.get('before')
+    if before and not ObjectId.is_valid(before):
+        return jsonify({"error": "before must be a message id"}), 400
+    
+    logger.info(f"💬 Fetching messages for project {project_id}")
+    
+    # Run the query and read the first batch before any bytes go out, so a
+    # DB failure is a 500 from the error handlers, not a 200 with no messages
+    messages = iter_project_messages(project_id, limit=limit, before=before, include_data=include_data)
+    first = next(messages, None)
+    
+    dumpb = current_app.json.dumpb
+    
+    def generate():
+        # Same {"ok": true, "messages": [...]} body, one message at a time
+        yield b'{"ok":true,"messages":['
+        if first is not None:
+            yield dumpb(first)
+            try:
+                for message in messages:
+                    yield b',' + dumpb(message)
+            except Exception as e:
+                # Headers are already sent; abort the body rather than close
+                # it, so the client sees a broken response, not a short list
+                logger.error(f"❌ Error streaming messages: {str(e)}")
+                raise
+        yield b']}'
+    
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+
+@project_bp.route("/projects/messages/batch", methods=["POST"])
+def get_messages_batch():
+    """Get messages for several projects in one request"""
+    data = request.get_json(silent=True) or {}
+    project_ids = data.get('project_ids')
+    
+    if not isinstance(project_ids, list) or not all(isinstance(pid, str) for pid in project_ids):
+        return jsonify({"error": "project_ids must be a list of strings"}), 400
+    if len(project_ids) > MAX_BATCH_PROJECTS:
+        return jsonify({"error": f"At most {MAX_BATCH_PROJECTS} project_ids per request"}), 400
+    
+    logger.info(f"💬 Fetching messages for {len(project_ids)} projects")
+    
+    messages = get_project_messages_batch(g.user_id, project_ids)
+    if messages is None:
+        return jsonify({"error": "Failed to fetch messages"}), 500
+    
+    return jsonify({
+        "ok": True,
+        "messages": messages
+    })
 
 
 @project_bp.route("/projects/<project_id>/messages", methods=["POST"])
 def add_message(project_id):
     """Add a message to a project"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        data = request.get_json()
-        role = data.get('role')  # 'user' or 'assistant'
-        content = data.get('content')
-        message_data = data.get('data')  # questions, plans, etc.
-        
-        if not role or not content:
-            return jsonify({"error": "role and content required"}), 400
-        
-        logger.info(f"💬 Saving {role} message to project {project_id}")
-        
-        message = save_message(project_id, role, content, message_data)
-        
-        if message:
-            return jsonify({
-                "ok": True,
-                "message": message
-            })
-        else:
-            return jsonify({"error": "Failed to save message"}), 500
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error saving message: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    data = request.get_json(silent=True) or {}
+    role = data.get('role')  # 'user' or 'assistant'
+    content = data.get('content')
+    message_data = data.get('data')  # questions, plans, etc.
+    
+    if not role or not content:
+        return jsonify({"error": "role and content required"}), 400
+    
+    logger.info(f"💬 Saving {role} message to project {project_id}")
+    
+    message = save_message(project_id, role, content, message_data)
+    
+    if message:
+        return jsonify({
+            "ok": True,
+            "message": message
+        })
+    else:
+        return jsonify({"error": "Failed to save message"}), 500
 
 
 @project_bp.route("/api/database/stats", methods=["GET"])
 def database_stats():
     """Get database statistics"""
-    try:
-        stats = get_database_stats()
-        return jsonify({
-            "ok": True,
-            "stats": stats
-        })
-    except Exception as e:
-        logger.error(f"❌ Error getting database stats: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    stats = get_database_stats()
+    return jsonify({
+        "ok": True,
+        "stats": stats
+    })
 
 
 # ============== TASK OPERATIONS ==============
@@ -245,139 +219,72 @@ def database_stats():
 @project_bp.route("/projects/<project_id>/tasks", methods=["GET"])
 def get_tasks(project_id):
     """Get all tasks for a project"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        status_filter = request.args.get('status')  # Optional status filter
-        
-        logger.info(f"📋 Fetching tasks for project {project_id}")
-        
-        tasks = get_project_tasks(project_id, status_filter)
-        
-        return jsonify({
-            "ok": True,
-            "tasks": tasks
-        })
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error fetching tasks: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    status_filter = request.args.get('status')  # Optional status filter
+    limit = request.args.get('limit', type=int)
+    
+    logger.info(f"📋 Fetching tasks for project {project_id}")
+    
+    tasks = get_project_tasks(project_id, status_filter, limit=limit)
+    
+    return jsonify({
+        "ok": True,
+        "tasks": tasks
+    })
 
 
 @project_bp.route("/projects/<project_id>/tasks", methods=["POST"])
 def create_project_tasks(project_id):
     """Create tasks for a project from AI-generated subtasks"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        data = request.get_json()
-        subtasks = data.get('subtasks', [])
-        session_id = data.get('session_id')
-        
-        if not subtasks:
-            return jsonify({"error": "subtasks required"}), 400
-        
-        logger.info(f"✅ Creating {len(subtasks)} tasks for project {project_id}")
-        
-        task_ids = create_tasks(project_id, subtasks, session_id)
-        
-        if task_ids:
-            return jsonify({
-                "ok": True,
-                "task_ids": task_ids,
-                "count": len(task_ids)
-            })
-        else:
-            return jsonify({"error": "Failed to create tasks"}), 500
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error creating tasks: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    data = request.get_json(silent=True) or {}
+    subtasks = data.get('subtasks', [])
+    session_id = data.get('session_id')
+    
+    if not subtasks:
+        return jsonify({"error": "subtasks required"}), 400
+    
+    logger.info(f"✅ Creating {len(subtasks)} tasks for project {project_id}")
+    
+    task_ids = create_tasks(project_id, subtasks, session_id)
+    
+    if task_ids:
+        return jsonify({
+            "ok": True,
+            "task_ids": task_ids,
+            "count": len(task_ids)
+        })
+    else:
+        return jsonify({"error": "Failed to create tasks"}), 500
 
 
 @project_bp.route("/tasks/<task_id>", methods=["PUT"])
 def update_task_route(task_id):
     """Update a task (e.g., status, assignee, etc.)"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        data = request.get_json()
-        
-        # Remove fields that shouldn't be updated directly
-        updates = {k: v for k, v in data.items() if k not in ['_id', 'id', 'project_id', 'created_at', 'created_from']}
-        
-        logger.info(f"✏️ Updating task {task_id}")
-        
-        success = update_task(task_id, updates)
-        
-        if success:
-            return jsonify({"ok": True})
-        else:
-            return jsonify({"error": "Failed to update task"}), 500
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error updating task: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    data = request.get_json(silent=True) or {}
+    
+    # Remove fields that shouldn't be updated directly
+    updates = {k: v for k, v in data.items() if k not in _TASK_IMMUTABLE}
+    
+    logger.info(f"✏️ Updating task {task_id}")
+    
+    success = update_task(task_id, updates)
+    
+    if success:
+        return ok_response()
+    else:
+        return jsonify({"error": "Failed to update task"}), 500
 
 
 @project_bp.route("/tasks/<task_id>", methods=["DELETE"])
 def delete_task_route(task_id):
     """Delete a task"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Verify JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        logger.info(f"🗑️ Deleting task {task_id}")
-        
-        success = delete_task(task_id)
-        
-        if success:
-            return jsonify({"ok": True})
-        else:
-            return jsonify({"error": "Failed to delete task"}), 404
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error deleting task: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    logger.info(f"🗑️ Deleting task {task_id}")
+    
+    success = delete_task(task_id)
+    
+    if success:
+        return ok_response()
+    else:
+        return jsonify({"error": "Failed to delete task"}), 404
 
 
 logger.info("✅ Project routes registered")
@@ -2,29 +2,73 @@
 Slack API Routes
 Handles Slack OAuth and messaging
 """
-from flask import Blueprint, request, redirect, jsonify, session
+from flask import Blueprint, request, redirect, jsonify, session, g
 import logging
-import requests
-import json
+import hashlib
+import secrets
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 from urllib.parse import urlencode
 from datetime import datetime
 from app.config import Config
+from app.services.jobs import submit_job, get_job
+from app.utils.errors import register_error_handlers
+from app.utils.http import create_session, DEFAULT_TIMEOUT
+from app.utils.jwt_cache import extract_bearer, require_auth, verify_jwt_cached
 import jwt
-import os
 
 logger = logging.getLogger(__name__)
 slack_bp = Blueprint('slack', __name__)
-JWT_SECRET = os.getenv('FLASK_SECRET', 'change_this_secret')
+register_error_handlers(slack_bp)
+
+SLACK_USERS_INFO_URL = "https://slack.com/api/users.info"
+SLACK_REDIRECT_URI = f"{Config.BACKEND_URL}/slack/oauth_redirect"
+
+# Everything in the authorize URL except the per-install CSRF state
+_SLACK_AUTH_URL_PREFIX = "https://slack.com/oauth/v2/authorize?" + urlencode({
+    "client_id": Config.SLACK_CLIENT_ID,
+    "scope": (
+        "app_mentions:read,bookmarks:read,assistant:write,canvases:read,"
+        "canvases:write,channels:read,channels:join,groups:read,"
+        "channels:history,groups:history,im:history,im:read,mpim:history,"
+        "chat:write,users:read,team:read"
+    ),
+    "redirect_uri": SLACK_REDIRECT_URI
+}) + "&state="
+
+# Shared keep-alive session for slack.com
+_slack = create_session(pool_connections=20, pool_maxsize=100)
+
+# Slack user id -> display name; names rarely change, so keep them for an hour
+_name_cache = TTLCache(maxsize=50000, ttl=3600)
+_name_cache_lock = threading.Lock()
+# Pool for the users.info fan-out in get_channel_history
+_users_info_pool = ThreadPoolExecutor(max_workers=10, thread_name_prefix="slack-users")
+
+# Slack token documents by app user id; they only change on OAuth install
+_token_cache = TTLCache(maxsize=10000, ttl=60)
+_token_cache_lock = threading.Lock()
+SLACK_TOKEN_PROJECTION = {"bot_token": 1, "access_token": 1, "team_id": 1, "_id": 0}
+
+# conversations.list results per user, for repeat channel-picker opens
+_channels_cache = TTLCache(maxsize=10000, ttl=60)
+_channels_cache_lock = threading.Lock()
+
+# (user id, channel) pairs we've already joined, so send_message can skip
+# conversations.join; a not_in_channel reply evicts the entry and rejoins
+_joined_channels = TTLCache(maxsize=100000, ttl=3600)
+_joined_channels_lock = threading.Lock()
 
 tokens_collection = None
 
 def get_tokens_collection():
-    """Get tokens collection (lazy initialization)"""
+    """Get tokens collection (lazy initialization, indexes are created by init_db)"""
     global tokens_collection
     if tokens_collection is None:
         from app.database.mongodb import db
         tokens_collection = db['slack_tokens']
-        tokens_collection.create_index([("user_id", 1)], unique=True)
     return tokens_collection
 
 def save_token(user_id, team_id, access_token, scope, bot_token=None):
@@ -44,17 +88,79 @@ def save_token(user_id, team_id, access_token, scope, bot_token=None):
             },
             upsert=True
         )
+        with _token_cache_lock:
+            _token_cache.pop(user_id, None)
+        # A reinstall may point at a different workspace
+        with _channels_cache_lock:
+            _channels_cache.pop(user_id, None)
         logger.info(f"✅ Slack token saved for user {user_id}")
         return True
     except Exception as e:
         logger.error(f"❌ Error saving token: {str(e)}")
         return False
 
+def fetch_user_name(slack_user_id, headers):
+    """Look up a Slack user's real name, caching successful lookups"""
+    response = _slack.get(SLACK_USERS_INFO_URL, headers=headers, params={"user": slack_user_id}, timeout=DEFAULT_TIMEOUT)
+    user_data = orjson.loads(response.content)
+    if not user_data.get("ok"):
+        return "Unknown"
+    
+    name = user_data.get("user", {}).get("real_name", "Unknown")
+    with _name_cache_lock:
+        _name_cache[slack_user_id] = name
+    return name
+
+def resolve_user_names(slack_user_ids, headers):
+    """Map Slack user ids to names, fetching uncached ids concurrently"""
+    names = {}
+    missing = []
+    with _name_cache_lock:
+        for uid in slack_user_ids:
+            name = _name_cache.get(uid)
+            if name is None:
+                missing.append(uid)
+            else:
+                names[uid] = name
+    
+    if missing:
+        fetched = _users_info_pool.map(lambda uid: fetch_user_name(uid, headers), missing)
+        names.update(zip(missing, fetched))
+    return names
+
+def join_channel(joined_key, headers):
+    """Join the channel in joined_key=(user id, channel), remembering success"""
+    try:
+        response = _slack.post(
+            "https://slack.com/api/conversations.join",
+            headers=headers,
+            json={"channel": joined_key[1]},
+            timeout=DEFAULT_TIMEOUT
+        )
+        ok = bool(orjson.loads(response.content).get("ok"))
+    except Exception as e:
+        logger.warning(f"⚠️ Could not join channel: {str(e)}")
+        return False
+    
+    if ok:
+        with _joined_channels_lock:
+            _joined_channels[joined_key] = True
+    return ok
+
 def get_token_for_user(user_id):
-    """Get Slack token for user"""
+    """Get Slack token for user, cached for 60 seconds once connected"""
+    with _token_cache_lock:
+        token_doc = _token_cache.get(user_id)
+    if token_doc is not None:
+        return token_doc
+    
     try:
         collection = get_tokens_collection()
-        token_doc = collection.find_one({"user_id": user_id})
+        token_doc = collection.find_one({"user_id": user_id}, SLACK_TOKEN_PROJECTION)
+        # Misses aren't cached so a fresh install shows up immediately
+        if token_doc is not None:
+            with _token_cache_lock:
+                _token_cache[user_id] = token_doc
         return token_doc
     except Exception as e:
         logger.error(f"❌ Error getting token: {str(e)}")
@@ -71,44 +177,24 @@ def slack_install():
     if not token:
         return jsonify({"error": "No authentication token provided"}), 401
     
-    try:
-        # Verify JWT and extract user_id
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
-        
-        # Store user_id in session for callback
-        session['pending_slack_user_id'] = user_id
-        session['auth_token'] = token
-        
-        logger.info(f"Slack OAuth initiated for user: {user_id}")
-        
-        # Generate state for CSRF protection
-        import secrets
-        state = secrets.token_hex(8)
-        session['slack_state'] = state
-        
-        params = {
-            "client_id": Config.SLACK_CLIENT_ID,
-            "scope": (
-                "app_mentions:read,bookmarks:read,assistant:write,canvases:read,"
-                "canvases:write,channels:read,channels:join,groups:read,"
-                "channels:history,groups:history,im:history,im:read,mpim:history,"
-                "chat:write,users:read,team:read"
-            ),
-            "redirect_uri": f"{Config.BACKEND_URL}/slack/oauth_redirect",
-            "state": state
-        }
-        
-        auth_url = f"https://slack.com/oauth/v2/authorize?{urlencode(params)}"
-        logger.info(f"🔗 Redirect to: {auth_url}")
-        logger.info("="*60)
-        
-        return redirect(auth_url)
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
+    # Verify JWT and extract user_id (failures become 401s via the blueprint handlers)
+    payload = verify_jwt_cached(token)
+    user_id = payload['user_id']
+    
+    # Store user_id in session for callback
+    session['pending_slack_user_id'] = user_id
+    
+    logger.info(f"Slack OAuth initiated for user: {user_id}")
+    
+    # Generate state for CSRF protection (hex, so it needs no escaping)
+    state = secrets.token_hex(8)
+    session['slack_state'] = state
+    
+    auth_url = _SLACK_AUTH_URL_PREFIX + state
+    logger.info(f"🔗 Redirect to: {auth_url}")
+    logger.info("="*60)
+    
+    return redirect(auth_url)
 
 @slack_bp.route("/oauth_redirect", methods=["GET"])
 def slack_oauth_redirect():
@@ -148,14 +234,16 @@ def slack_oauth_redirect():
             "client_id": Config.SLACK_CLIENT_ID,
             "client_secret": Config.SLACK_CLIENT_SECRET,
             "code": code,
-            "redirect_uri": f"{Config.BACKEND_URL}/slack/oauth_redirect"
+            "redirect_uri": SLACK_REDIRECT_URI
         }
         
         logger.info("📡 Exchanging code for token...")
-        response = requests.post(token_url, data=data)
-        result = response.json()
+        response = _slack.post(token_url, data=data, timeout=DEFAULT_TIMEOUT)
+        result = orjson.loads(response.content)
         
-        logger.info(f"📦 Token exchange response: {json.dumps(result, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            # Never log the tokens themselves
+            logger.debug("📦 Token exchange response: %s", {k: v for k, v in result.items() if 'token' not in k})
         
         if not result.get("ok"):
             error_msg = result.get("error", "unknown_error")
@@ -188,56 +276,44 @@ def slack_oauth_redirect():
         return redirect(f"{Config.FRONTEND_URL}/slack?error=exchange_failed")
 
 @slack_bp.route("/api/list_conversations", methods=["GET"])
+@require_auth
 def list_conversations():
     """List Slack conversations for authenticated user"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    try:
-        # Get user's JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
-        
-        token_info = get_token_for_user(user_id)
-        if not token_info:
-            return jsonify({"error": "Slack not connected"}), 404
-        
-        slack_token = token_info.get("bot_token") or token_info.get("access_token")
-        
-        url = "https://slack.com/api/conversations.list"
-        headers = {"Authorization": f"Bearer {slack_token}"}
-        params = {"types": "public_channel,private_channel"}
-        
-        response = requests.get(url, headers=headers, params=params)
-        data = response.json()
-        
-        if not data.get("ok"):
-            return jsonify({"error": data.get("error", "unknown")}), 400
-        
-        channels = data.get("channels", [])
+    with _channels_cache_lock:
+        channels = _channels_cache.get(g.user_id)
+    if channels is not None:
         return jsonify({"channels": channels})
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error listing conversations: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    
+    token_info = get_token_for_user(g.user_id)
+    if not token_info:
+        return jsonify({"error": "Slack not connected"}), 404
+    
+    slack_token = token_info.get("bot_token") or token_info.get("access_token")
+    
+    url = "https://slack.com/api/conversations.list"
+    headers = {"Authorization": f"Bearer {slack_token}"}
+    params = {"types": "public_channel,private_channel"}
+    
+    response = _slack.get(url, headers=headers, params=params, timeout=DEFAULT_TIMEOUT)
+    data = orjson.loads(response.content)
+    
+    if not data.get("ok"):
+        return jsonify({"error": data.get("error", "unknown")}), 400
+    
+    channels = data.get("channels", [])
+    with _channels_cache_lock:
+        _channels_cache[g.user_id] = channels
+    return jsonify({"channels": channels})
 
 @slack_bp.route("/api/status", methods=["GET"])
 def slack_status():
     """Check if user has Slack connected"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
+    token = extract_bearer(request)
+    if not token:
         return jsonify({"connected": False}), 200
     
     try:
-        # Get user's JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        payload = verify_jwt_cached(token)
         user_id = payload['user_id']
         
         # Check if user has Slack token
@@ -263,118 +339,94 @@ def slack_status():
         return jsonify({"connected": False, "error": str(e)}), 500
 
 @slack_bp.route("/api/channel_history", methods=["GET"])
+@require_auth
 def get_channel_history():
     """Get message history from a Slack channel"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-
-    try:
-        # Get user's JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
+    slack_token_doc = get_token_for_user(g.user_id)
+    if not slack_token_doc or not slack_token_doc.get('access_token'):
+        return jsonify({"error": "Slack not connected for this user"}), 400
+    
+    slack_access_token = slack_token_doc['access_token']
+    
+    channel_id = request.args.get("channel")
+    limit = request.args.get("limit", "50")  # Default last 50 messages
+    
+    if not channel_id:
+        return jsonify({"error": "Channel ID required"}), 400
 
-        slack_token_doc = get_token_for_user(user_id)
-        if not slack_token_doc or not slack_token_doc.get('access_token'):
-            return jsonify({"error": "Slack not connected for this user"}), 400
-        
-        slack_access_token = slack_token_doc['access_token']
-        
-        channel_id = request.args.get("channel")
-        limit = request.args.get("limit", "50")  # Default last 50 messages
+    # Get messages from Slack API
+    url = "https://slack.com/api/conversations.history"
+    headers = {"Authorization": f"Bearer {slack_access_token}"}
+    params = {"channel": channel_id, "limit": limit}
+    
+    response = _slack.get(url, headers=headers, params=params, timeout=DEFAULT_TIMEOUT)
+    data = orjson.loads(response.content)
+    
+    if data.get("ok"):
+        messages = data.get("messages", [])
+        
+        # Resolve each distinct author once, in parallel
+        user_cache = resolve_user_names({msg["user"] for msg in messages if msg.get("user")}, headers)
+        enriched_messages = []
+        
+        for msg in messages:
+            enriched_messages.append({
+                "text": msg.get("text", ""),
+                "user": user_cache.get(msg.get("user"), "Bot"),
+                "timestamp": msg.get("ts", ""),
+                "type": msg.get("type", "message")
+            })
         
-        if not channel_id:
-            return jsonify({"error": "Channel ID required"}), 400
-
-        # Get messages from Slack API
-        url = "https://slack.com/api/conversations.history"
-        headers = {"Authorization": f"Bearer {slack_access_token}"}
-        params = {"channel": channel_id, "limit": limit}
-        
-        response = requests.get(url, headers=headers, params=params)
-        data = response.json()
-        
-        if data.get("ok"):
-            messages = data.get("messages", [])
-            
-            # Get user info for each message
-            user_cache = {}
-            enriched_messages = []
-            
-            for msg in messages:
-                user_id_msg = msg.get("user")
-                if user_id_msg and user_id_msg not in user_cache:
-                    # Fetch user info
-                    user_url = "https://slack.com/api/users.info"
-                    user_response = requests.get(user_url, headers=headers, params={"user": user_id_msg})
-                    user_data = user_response.json()
-                    if user_data.get("ok"):
-                        user_cache[user_id_msg] = user_data.get("user", {}).get("real_name", "Unknown")
-                    else:
-                        user_cache[user_id_msg] = "Unknown"
-                
-                enriched_messages.append({
-                    "text": msg.get("text", ""),
-                    "user": user_cache.get(msg.get("user"), "Bot"),
-                    "timestamp": msg.get("ts", ""),
-                    "type": msg.get("type", "message")
-                })
-            
-            return jsonify({"ok": True, "messages": enriched_messages})
-        else:
-            logger.error(f"❌ Slack API error: {data.get('error')}")
-            return jsonify({"error": data.get("error", "Unknown Slack API error")}), 500
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error fetching channel history: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"ok": True, "messages": enriched_messages})
+    else:
+        logger.error(f"❌ Slack API error: {data.get('error')}")
+        return jsonify({"error": data.get("error", "Unknown Slack API error")}), 500
 
 @slack_bp.route("/api/summarize_channel", methods=["POST"])
+@require_auth
 def summarize_channel():
-    """Generate AI summary of Slack channel messages"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
+    """Generate AI summary of Slack channel messages.
 
-    try:
-        # Get user's JWT token
-        token = auth_header.replace('Bearer ', '')
-        jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        
-        body = request.get_json()
-        messages = body.get("messages", [])
-        
-        if not messages:
-            return jsonify({"error": "No messages provided"}), 400
+    With ?async=1 the summary runs as a background job: the response is a
+    202 with a job_id to poll at /api/summaries/<job_id>.
+    """
+    body = request.get_json(silent=True) or {}
+    messages = body.get("messages", [])
+    
+    if not messages:
+        return jsonify({"error": "No messages provided"}), 400
 
-        # Call AI service to generate summary
-        from app.services.ai_service import summarize_slack_messages
-        
-        summary = summarize_slack_messages(messages)
-        
-        return jsonify({"ok": True, "summary": summary})
-            
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error generating summary: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    # Call AI service to generate summary
+    from app.services.ai_service import summarize_slack_messages
+    
+    if request.args.get("async") == "1":
+        digest = hashlib.sha256(orjson.dumps(messages)).hexdigest()
+        job_id = submit_job(g.user_id, summarize_slack_messages, messages, coalesce_key=(g.user_id, digest))
+        return jsonify({"ok": True, "job_id": job_id, "status": "pending"}), 202
+    
+    summary = summarize_slack_messages(messages)
+    
+    return jsonify({"ok": True, "summary": summary})
+
+@slack_bp.route("/api/summaries/<job_id>", methods=["GET"])
+@require_auth
+def get_summary_job(job_id):
+    """Poll a background summary job"""
+    job = get_job(job_id)
+    if not job or job.get("owner") != g.user_id:
+        return jsonify({"error": "Job not found"}), 404
+    
+    if job["status"] == "done":
+        return jsonify({"ok": True, "status": "done", "summary": job["result"]})
+    if job["status"] == "failed":
+        return jsonify({"ok": False, "status": "failed", "error": job["error"]})
+    return jsonify({"ok": True, "status": "pending"})
 
 @slack_bp.route("/api/send_message", methods=["POST"])
+@require_auth
 def send_message():
     """Send a message to Slack"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return jsonify({"error": "No authorization provided"}), 401
-    
-    body = request.get_json()
+    body = request.get_json(silent=True) or {}
     channel = body.get("channel")
     text = body.get("text")
     mention_user_id = body.get("mention_user_id")
@@ -386,47 +438,41 @@ def send_message():
     if not channel or not text:
         return jsonify({"error": "channel and text required"}), 400
     
-    try:
-        # Get user's JWT token
-        token = auth_header.replace('Bearer ', '')
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload['user_id']
-        
-        token_info = get_token_for_user(user_id)
-        if not token_info:
-            return jsonify({"error": "Slack not connected"}), 404
-        
-        slack_token = token_info.get("bot_token") or token_info.get("access_token")
-        
-        # Join channel first
-        try:
-            join_url = "https://slack.com/api/conversations.join"
-            join_headers = {"Authorization": f"Bearer {slack_token}", "Content-Type": "application/json"}
-            join_payload = {"channel": channel}
-            requests.post(join_url, headers=join_headers, json=join_payload)
-        except Exception as e:
-            logger.warning(f"⚠️ Could not join channel: {str(e)}")
-        
-        # Send message
-        final_text = text
-        if mention_user_id:
-            final_text = f"<@{mention_user_id}> {text}"
-        
-        url = "https://slack.com/api/chat.postMessage"
-        headers = {"Authorization": f"Bearer {slack_token}", "Content-Type": "application/json"}
-        payload = {"channel": channel, "text": final_text}
-        
-        response = requests.post(url, headers=headers, json=payload)
-        data = response.json()
-        
-        logger.info(f"Slack response: {json.dumps(data, indent=2)}")
-        
-        return jsonify(data)
-        
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-    except Exception as e:
-        logger.error(f"❌ Error sending message: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    token_info = get_token_for_user(g.user_id)
+    if not token_info:
+        return jsonify({"error": "Slack not connected"}), 404
+    
+    slack_token = token_info.get("bot_token") or token_info.get("access_token")
+    
+    headers = {"Authorization": f"Bearer {slack_token}", "Content-Type": "application/json"}
+    joined_key = (g.user_id, channel)
+    
+    # Join channel first, unless we already did recently
+    with _joined_channels_lock:
+        joined = joined_key in _joined_channels
+    if not joined:
+        join_channel(joined_key, headers)
+    
+    # Send message
+    final_text = text
+    if mention_user_id:
+        final_text = f"<@{mention_user_id}> {text}"
+    
+    url = "https://slack.com/api/chat.postMessage"
+    payload = {"channel": channel, "text": final_text}
+    
+    response = _slack.post(url, headers=headers, json=payload, timeout=DEFAULT_TIMEOUT)
+    data = orjson.loads(response.content)
+    
+    # Cached membership went stale (bot was removed): rejoin and retry once
+    if joined and data.get("error") == "not_in_channel":
+        with _joined_channels_lock:
+            _joined_channels.pop(joined_key, None)
+        if join_channel(joined_key, headers):
+            response = _slack.post(url, headers=headers, json=payload, timeout=DEFAULT_TIMEOUT)
+            data = orjson.loads(response.content)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Slack response: %s", data)
+    
+    return jsonify(data)
@@ -1,18 +1,159 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
+import hashlib
 import logging
 import uuid
-from app.services.ai_service import analyze_task_with_llm, generate_implementation_plan, get_conversation_history
+from itertools import count
+from app.database.mongodb import get_cached_llm_response, save_cached_llm_response
+from app.services.ai_service import analyze_task_with_llm, generate_implementation_plan, get_conversation_history, remember_analysis
 from app.services.github_service import get_user_repos, analyze_repo_structure
-import requests as req
+from app.services.semantic_cache import SemanticCache
+from app.services.singleflight import SingleFlight
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(name)s] - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 task_bp = Blueprint('task', __name__)
 
+# Bump to invalidate cached analyses after prompt or model changes
+ANALYSIS_CACHE_VERSION = "v1"
+
+# The same task reworded only in case, punctuation or filler words reuses
+# an earlier analysis for the same repo; any change in the words asks again
+_analysis_semantic_cache = SemanticCache()
+
+# Identical analyses already in progress are shared instead of re-run
+_analysis_flights = SingleFlight()
+
+# Only every Nth error gets a full traceback, so a flapping upstream
+# doesn't turn every failed request into a stack walk
+TRACEBACK_SAMPLE_RATE = 20
+_error_counter = count()
+
+
+# Expected JSON types of each endpoint's body fields; checked once up front
+# so a malformed body is a 400, not a TypeError deep inside the handler
+ANALYZE_FIELDS = {'task': str, 'session_id': str, 'owner': str, 'repo': str, 'github_token': str}
+PLAN_FIELDS = {'task': str, 'session_id': str, 'answers': dict, 'team_members': list, 'regenerate': bool}
+
+
+def validate_body(body, fields):
+    """Return an error message if body isn't an object with correctly typed fields"""
+    if not isinstance(body, dict):
+        return "JSON object body required"
+    for name, expected in fields.items():
+        value = body.get(name)
+        if value is not None and not isinstance(value, expected):
+            return f"{name} must be a {'string' if expected is str else expected.__name__}"
+    return None
+
+
+def log_error(message, *args):
+    """Log an endpoint error, with the traceback for a sample of them"""
+    if next(_error_counter) % TRACEBACK_SAMPLE_RATE == 0:
+        logger.exception(message, *args)
+    else:
+        logger.error(message, *args)
+
+
+def analysis_cache_namespace(owner, repo, github_token):
+    """Scope cached analyses to a repo and the token that could read it.
+
+    Analyses can include private repo context, so they are never shared
+    between callers holding different GitHub tokens.
+    """
+    token_digest = hashlib.sha256(github_token.encode()).hexdigest()[:16] if github_token else "-"
+    return f"{owner}/{repo}|{token_digest}"
+
+
+def analysis_cache_key(task, namespace):
+    """Exact-match cache key for an analysis of task within namespace"""
+    raw = f"{task.strip().lower()}|{namespace}|{ANALYSIS_CACHE_VERSION}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def run_analysis(cache_key, cache_namespace, task, session_id, owner, repo, github_token):
+    """Fetch repo context, run the LLM analysis and cache the result"""
+    # Fetch repo context if provided
+    repo_context = None
+    if owner and repo and github_token:
+        logger.info("🔍 Fetching repository context...")
+        repo_context = analyze_repo_structure(owner, repo, github_token)
+        logger.info(f"✅ Context fetched: {len(repo_context.get('folders', {}))} folders")
+    
+    logger.info("🤖 Starting AI analysis...")
+    result = analyze_task_with_llm(task, session_id, repo_context, owner, repo, github_token)
+    save_cached_llm_response(cache_key, result)
+    _analysis_semantic_cache.add(cache_namespace, task, result)
+    return result
+
+
+def analysis_response(task, session_id, owner, repo, github_token):
+    """Resolve an analysis from cache, an in-flight run or a fresh run"""
+    cache_namespace = analysis_cache_namespace(owner, repo, github_token)
+    cache_key = analysis_cache_key(task, cache_namespace)
+    result = get_cached_llm_response(cache_key)
+    if result is None:
+        result = _analysis_semantic_cache.lookup(cache_namespace, task)
+        if result is not None:
+            logger.info("⚡ Semantic cache hit for task")
+    
+    if result is not None:
+        logger.info("⚡ Serving analysis from cache")
+        remember_analysis(session_id, task, result)
+    else:
+        result, shared = _analysis_flights.do(
+            cache_key, run_analysis, cache_key, cache_namespace, task, session_id, owner, repo, github_token
+        )
+        if shared:
+            # The leader recorded its own session; record ours too
+            logger.info("🔗 Joined an identical in-flight analysis")
+            remember_analysis(session_id, task, result)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("✅ Analysis Complete: %s", result)
+    
+    response = {
+        "session_id": session_id,
+        "status": result.get('status'),
+        "analysis": result.get('analysis'),
+        "questions": result.get('questions'),
+        "search_queries": result.get('search_queries')
+    }
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📤 Response: %s", response)
+    return response
+
+
+def stream_analysis(task, session_id, owner, repo, github_token):
+    """Stream an analysis as NDJSON events.
+
+    An "accepted" line (carrying the session id) goes out immediately, so
+    clients and proxies see bytes while the LLM runs; the response body
+    follows as a "result" line, or an "error" line if the analysis fails.
+    """
+    dumpb = current_app.json.dumpb
+    
+    def generate():
+        yield dumpb({"event": "accepted", "session_id": session_id}) + b"\n"
+        try:
+            response = analysis_response(task, session_id, owner, repo, github_token)
+            yield dumpb({"event": "result", **response}) + b"\n"
+        except Exception as e:
+            log_error("❌ Error in streamed analysis: %s", e)
+            yield dumpb({"event": "error", "error": str(e)}) + b"\n"
+        logger.info("="*80 + "\n")
+    
+    return current_app.response_class(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no'}  # Let nginx pass the first line straight through
+    )
+
+
 @task_bp.route("/analyze", methods=["POST", "OPTIONS"])
 def analyze():
-    """Analyze task with repository context"""
+    """Analyze task with repository context (?stream=1 for NDJSON progress)"""
     if request.method == "OPTIONS":
         return jsonify({"ok": True}), 200
     
@@ -21,8 +162,12 @@ def analyze():
     logger.info("="*80)
     
     try:
-        body = request.get_json()
-        logger.info(f"📦 Request Body: {body}")
+        body = request.get_json(silent=True) or {}
+        error = validate_body(body, ANALYZE_FIELDS)
+        if error:
+            return jsonify({"error": error}), 400
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📦 Request Body: %s", {k: v for k, v in body.items() if k != 'github_token'})
         
         task = body.get('task')
         session_id = body.get('session_id') or str(uuid.uuid4())
@@ -38,34 +183,16 @@ def analyze():
             logger.error("❌ No task provided")
             return jsonify({"error": "task required"}), 400
         
-        # Fetch repo context if provided
-        repo_context = None
-        if owner and repo and github_token:
-            logger.info("🔍 Fetching repository context...")
-            repo_context = analyze_repo_structure(owner, repo, github_token)
-            logger.info(f"✅ Context fetched: {len(repo_context.get('folders', {}))} folders")
-        
-        logger.info("🤖 Starting AI analysis...")
-        result = analyze_task_with_llm(task, session_id, repo_context, owner, repo, github_token)
-        
-        logger.info(f"✅ Analysis Complete: {result}")
-        
-        response = {
-            "session_id": session_id,
-            "status": result.get('status'),
-            "analysis": result.get('analysis'),
-            "questions": result.get('questions'),
-            "search_queries": result.get('search_queries')
-        }
+        if request.args.get('stream') == '1':
+            return stream_analysis(task, session_id, owner, repo, github_token)
         
-        logger.info(f"📤 Response: {response}")
+        response = analysis_response(task, session_id, owner, repo, github_token)
         logger.info("="*80 + "\n")
         
         return jsonify(response)
         
     except Exception as e:
-        logger.error(f"❌ Error in analyze endpoint: {str(e)}")
-        logger.exception("Full traceback:")
+        log_error("❌ Error in analyze endpoint: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @task_bp.route("/generate_plan", methods=["POST", "OPTIONS"])
@@ -79,34 +206,42 @@ def generate_plan():
     logger.info("="*80)
     
     try:
-        body = request.get_json()
-        logger.info(f"📦 Request Body: {body}")
+        body = request.get_json(silent=True) or {}
+        error = validate_body(body, PLAN_FIELDS)
+        if error:
+            return jsonify({"error": error}), 400
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📦 Request Body: %s", {k: v for k, v in body.items() if k != 'github_token'})
         
         task = body.get('task')
-        answers = body.get('answers', {})
+        answers = body.get('answers') or {}
         session_id = body.get('session_id')
-        team_members = body.get('team_members', [])
+        team_members = body.get('team_members') or []
+        # Skip cached plans so asking again gets a new one
+        regenerate = body.get('regenerate', False)
         
         logger.info(f"📝 Task: {task}")
-        logger.info(f"💬 Answers: {answers}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("💬 Answers: %s", answers)
         logger.info(f"🔑 Session ID: {session_id}")
-        logger.info(f"👥 Team Members: {team_members}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("👥 Team Members: %s", team_members)
         
         if not task or not task.strip():
             logger.error("❌ No task provided")
             return jsonify({"error": "task required"}), 400
         
         logger.info("🤖 Starting plan generation...")
-        result = generate_implementation_plan(task, answers, session_id, team_members)
+        result = generate_implementation_plan(task, answers, session_id, team_members, use_cache=not regenerate)
         
-        logger.info(f"✅ Plan Generated: {result}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✅ Plan Generated: %s", result)
         logger.info("="*80 + "\n")
         
         return jsonify(result)
         
     except Exception as e:
-        logger.error(f"❌ Error in generate_plan endpoint: {str(e)}")
-        logger.exception("Full traceback:")
+        log_error("❌ Error in generate_plan endpoint: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @task_bp.route("/github/repos", methods=["POST", "OPTIONS"])
@@ -116,7 +251,7 @@ def get_repos():
         return jsonify({"ok": True}), 200
     
     try:
-        body = request.get_json()
+        body = request.get_json(silent=True) or {}
         github_token = body.get('github_token')
         
         if not github_token:
@@ -131,13 +266,14 @@ def get_repos():
 
 @task_bp.route("/conversation_history/<session_id>", methods=["GET", "OPTIONS"])
 def get_history(session_id):
-    """Get conversation history for a session"""
+    """Get conversation history for a session (?limit=N for the latest N turns)"""
     if request.method == "OPTIONS":
         return jsonify({"ok": True}), 200
     
     try:
+        limit = request.args.get('limit', type=int)
         logger.info(f"📜 Fetching conversation history for session: {session_id}")
-        history = get_conversation_history(session_id)
+        history = get_conversation_history(session_id, limit)
         logger.info(f"✅ Found {len(history.get('conversations', []))} conversations")
         return jsonify(history)
         
@@ -22,6 +22,9 @@ class Config:
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
     DATABASE_NAME = "feeta"
     
+    # Redis (optional) - enables server-side sessions, e.g. unix:///var/run/redis/redis.sock
+    REDIS_URL = os.getenv("REDIS_URL")
+    
     # GitHub OAuth
     GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
     GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
@@ -3,11 +3,14 @@ from app.database.mongodb import (
     init_db,
     db, users_collection, projects_collection, messages_collection,
     repo_context_collection, conversation_history_collection,
-    create_or_update_user, get_user,
-    create_project, get_user_projects, update_project, delete_project,
-    save_message, get_project_messages,
+    create_or_update_user, get_user, get_user_by_id_cached, invalidate_user_cache,
+    create_project, get_user_projects,
+    update_project, delete_project,
+    save_message, get_project_messages, get_project_messages_batch, iter_project_messages,
     save_repo_context, get_repo_context, update_repo_context,
-    save_conversation_history, get_conversation_history,
+    save_conversation_history, get_conversation_history, compact_conversation_history,
+    set_history_summarizer,
+    get_cached_llm_response, save_cached_llm_response,
     get_database_stats
 )
 
@@ -15,11 +18,14 @@ __all__ = [
     'init_db',
     'db', 'users_collection', 'projects_collection', 'messages_collection',
     'repo_context_collection', 'conversation_history_collection',
-    'create_or_update_user', 'get_user',
-    'create_project', 'get_user_projects', 'update_project', 'delete_project',
-    'save_message', 'get_project_messages',
+    'create_or_update_user', 'get_user', 'get_user_by_id_cached', 'invalidate_user_cache',
+    'create_project', 'get_user_projects',
+    'update_project', 'delete_project',
+    'save_message', 'get_project_messages', 'get_project_messages_batch', 'iter_project_messages',
     'save_repo_context', 'get_repo_context', 'update_repo_context',
-    'save_conversation_history', 'get_conversation_history',
+    'save_conversation_history', 'get_conversation_history', 'compact_conversation_history',
+    'set_history_summarizer',
+    'get_cached_llm_response', 'save_cached_llm_response',
     'get_database_stats'
 ]
 
@@ -4,9 +4,15 @@ Handles all database operations for projects, messages, and repo context
 """
 import os
 import logging
-from datetime import datetime
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import datetime, timedelta
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, ReadPreference
+from pymongo.errors import OperationFailure
 from bson import ObjectId
+from cachetools import TTLCache
+from app.utils.background import run_in_background
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +29,58 @@ messages_collection = None
 repo_context_collection = None
 conversation_history_collection = None
 tasks_collection = None
+llm_response_cache_collection = None
+
+# Cached LLM responses expire after a day
+LLM_CACHE_TTL_SECONDS = 86400
+
+# Server error code for dropping an index that no longer exists
+INDEX_NOT_FOUND = 27
+
+# Once a session's history passes HISTORY_COMPACT_THRESHOLD turns, its oldest
+# HISTORY_COMPACT_BATCH turns are folded into a single summary turn
+HISTORY_COMPACT_THRESHOLD = 40
+HISTORY_COMPACT_BATCH = 20
+# A compaction_lock older than this is assumed to belong to a crashed worker
+HISTORY_COMPACT_LOCK_SECONDS = 300
+
+# Callable(turns) -> summary text, registered by the AI service layer
+_history_summarizer = None
+
+# Compaction waits on an LLM call, so it gets its own threads rather than the
+# shared background pool that short writes (and OAuth callbacks) rely on
+_compaction_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-compact")
+
+# In-process cache of user documents for the auth hot path, keyed by user id
+_user_cache = TTLCache(maxsize=5000, ttl=60)
+_user_cache_lock = threading.Lock()
+USER_CACHE_PROJECTION = {"email": 1, "name": 1, "github_token": 1, "github_username": 1}
+
+# Read projections: leave out fields the caller already knows (the owning
+# user / project id). Projects and tasks accept arbitrary update fields, so
+# those use exclusions rather than an allow-list.
+PROJECT_PROJECTION = {"user_id": 0}
+MESSAGE_PROJECTION = {"role": 1, "content": 1, "data": 1, "created_at": 1}
+# List views that only render text can skip the (potentially large) data payload
+MESSAGE_SUMMARY_PROJECTION = {"role": 1, "content": 1, "created_at": 1}
+TASK_PROJECTION = {"project_id": 0}
+
+# Aggregation stage that returns _id (and its id alias) as a string, so list
+# reads don't post-process every document in Python
+STRING_ID_STAGE = {"$addFields": {"_id": {"$toString": "$_id"}, "id": {"$toString": "$_id"}}}
+
+
+@lru_cache(maxsize=4096)
+def _oid(id_str):
+    """Parse a hex id string into an ObjectId, memoized for ids reused across requests"""
+    return ObjectId(id_str)
 
 
 def init_db():
     """Initialize MongoDB connection and create indexes"""
     global client, db, users_collection, projects_collection, messages_collection
     global repo_context_collection, conversation_history_collection, tasks_collection
+    global llm_response_cache_collection
     
     try:
         logger.info("🔌 Connecting to MongoDB...")
@@ -38,8 +90,12 @@ def init_db():
             serverSelectionTimeoutMS=5000,  # 5 second timeout
             connectTimeoutMS=10000,  # 10 second connection timeout
             socketTimeoutMS=10000,  # 10 second socket timeout
-            maxPoolSize=10,
-            retryWrites=True
+            maxPoolSize=50,  # Enough for every worker thread plus background writes
+            waitQueueTimeoutMS=2000,  # Fail fast instead of queueing on an exhausted pool
+            compressors="zstd,zlib",  # Large analysis / repo context docs; zstd needs `zstandard`
+            zlibCompressionLevel=-1,
+            retryWrites=True,
+            retryReads=True
         )
         
         # Test the connection
@@ -52,18 +108,49 @@ def init_db():
         users_collection = db['users']
         projects_collection = db['projects']
         messages_collection = db['messages']
-        repo_context_collection = db['repo_contexts']
+        # Repo contexts are written rarely and tolerate replication lag, so
+        # they can be served by secondaries; everything else reads its own writes
+        repo_context_collection = db.get_collection(
+            'repo_contexts', read_preference=ReadPreference.SECONDARY_PREFERRED
+        )
         conversation_history_collection = db['conversation_history']
         tasks_collection = db['tasks']
+        llm_response_cache_collection = db['llm_response_cache']
         
         # Create indexes for performance
         users_collection.create_index([("email", ASCENDING)], unique=True)
+        users_collection.create_index([("github_id", ASCENDING)], sparse=True)
         projects_collection.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
         messages_collection.create_index([("project_id", ASCENDING), ("created_at", ASCENDING)])
+        messages_collection.create_index([("project_id", ASCENDING), ("_id", DESCENDING)])
         repo_context_collection.create_index([("repo_full_name", ASCENDING)], unique=True)
         conversation_history_collection.create_index([("session_id", ASCENDING)], unique=True)
         tasks_collection.create_index([("project_id", ASCENDING), ("created_at", DESCENDING)])
-        tasks_collection.create_index([("status", ASCENDING)])
+        tasks_collection.create_index([("project_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)])
+        # Only open tasks are looked up by status alone; a partial index keeps
+        # the finished ones out of it (replaces the old full "status_1" index).
+        # $in in a partial filter needs MongoDB 6.0+, so older servers keep
+        # the full index and the rest of startup carries on
+        try:
+            tasks_collection.create_index(
+                [("status", ASCENDING)],
+                name="status_active",
+                partialFilterExpression={"status": {"$in": ["pending", "in_progress", "blocked"]}}
+            )
+        except OperationFailure as e:
+            logger.warning(f"⚠️ Keeping full status index, partial index not supported: {e}")
+            tasks_collection.create_index([("status", ASCENDING)])
+        else:
+            if "status_1" in tasks_collection.index_information():
+                try:
+                    tasks_collection.drop_index("status_1")
+                except OperationFailure as e:
+                    # Another worker booting in parallel dropped it first
+                    if e.code != INDEX_NOT_FOUND:
+                        raise
+        db['slack_tokens'].create_index([("user_id", ASCENDING)], unique=True)
+        llm_response_cache_collection.create_index([("cache_key", ASCENDING)], unique=True)
+        llm_response_cache_collection.create_index([("created_at", ASCENDING)], expireAfterSeconds=LLM_CACHE_TTL_SECONDS)
         
         logger.info("✅ MongoDB collections initialized with indexes")
         return True
@@ -115,6 +202,34 @@ def get_user(user_id):
         return None
 
 
+def get_user_by_id_cached(user_id, user_oid=None):
+    """Get a user by its ObjectId string, cached for 60 seconds once GitHub is connected.
+
+    Pass user_oid when the ObjectId is already parsed (e.g. from the JWT
+    cache). Only the fields in USER_CACHE_PROJECTION are fetched. The
+    returned document is shared between requests and must not be mutated.
+    """
+    key = str(user_id)
+    with _user_cache_lock:
+        user = _user_cache.get(key)
+    if user is not None:
+        return user
+    
+    user = users_collection.find_one({"_id": user_oid or ObjectId(key)}, USER_CACHE_PROJECTION)
+    # Users without a GitHub token aren't cached: the OAuth callback may land
+    # on another worker, whose invalidate_user_cache can't reach this cache
+    if user and user.get('github_token'):
+        with _user_cache_lock:
+            _user_cache[key] = user
+    return user
+
+
+def invalidate_user_cache(user_id):
+    """Drop a user from the in-process cache after it changes"""
+    with _user_cache_lock:
+        _user_cache.pop(str(user_id), None)
+
+
 # ============== PROJECT OPERATIONS ==============
 
 def create_project(user_id, name, repo_data=None):
@@ -139,20 +254,37 @@ def create_project(user_id, name, repo_data=None):
         return None
 
 
-def get_user_projects(user_id):
-    """Get all projects for a user"""
+def get_user_projects(user_id, limit=None, skip=0):
+    """Get projects for a user, newest first, with message counts in one aggregation"""
     try:
-        projects = list(projects_collection.find(
-            {"user_id": user_id}
-        ).sort("created_at", DESCENDING))
-        
-        for project in projects:
-            project['_id'] = str(project['_id'])
-            project['id'] = str(project['_id'])
-            
-            # Get message count for each project
-            msg_count = messages_collection.count_documents({"project_id": project['id']})
-            project['message_count'] = msg_count
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$sort": {"created_at": DESCENDING}}
+        ]
+        if skip:
+            pipeline.append({"$skip": skip})
+        if limit:
+            pipeline.append({"$limit": limit})
+        
+        # Messages reference projects by the string form of _id
+        pipeline += [
+            {"$lookup": {
+                "from": "messages",
+                "let": {"pid": {"$toString": "$_id"}},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$project_id", "$$pid"]}}},
+                    {"$count": "n"}
+                ],
+                "as": "msg_counts"
+            }},
+            {"$addFields": {
+                "message_count": {"$ifNull": [{"$arrayElemAt": ["$msg_counts.n", 0]}, 0]}
+            }},
+            {"$project": {"msg_counts": 0, **PROJECT_PROJECTION}},
+            STRING_ID_STAGE
+        ]
+        
+        projects = list(projects_collection.aggregate(pipeline))
         
         logger.info(f"✅ Found {len(projects)} projects for user {user_id}")
         return projects
@@ -167,7 +299,7 @@ def update_project(project_id, updates):
         updates['updated_at'] = datetime.utcnow()
         
         result = projects_collection.update_one(
-            {"_id": ObjectId(project_id)},
+            {"_id": _oid(project_id)},
             {"$set": updates}
         )
         
@@ -190,7 +322,7 @@ def delete_project(project_id):
         tasks_collection.delete_many({"project_id": project_id})
         
         # Delete the project
-        result = projects_collection.delete_one({"_id": ObjectId(project_id)})
+        result = projects_collection.delete_one({"_id": _oid(project_id)})
         
         if result.deleted_count > 0:
             logger.info(f"✅ Project {project_id} deleted")
@@ -206,22 +338,26 @@ def delete_project(project_id):
 def save_message(project_id, role, content, data=None):
     """Save a message to the database"""
     try:
+        now = datetime.utcnow()
+        message_id = ObjectId()  # Known up front, no need to wait for the insert
         message = {
+            "_id": message_id,
             "project_id": project_id,
             "role": role,  # 'user' or 'assistant'
             "content": content,
             "data": data,  # Store questions, plans, etc.
-            "created_at": datetime.utcnow()
+            "created_at": now
         }
         
-        result = messages_collection.insert_one(message)
-        message['_id'] = str(result.inserted_id)
-        message['id'] = str(result.inserted_id)
+        messages_collection.insert_one(message)
+        message['_id'] = str(message_id)
+        message['id'] = message['_id']
         
-        # Update project's updated_at timestamp
-        projects_collection.update_one(
-            {"_id": ObjectId(project_id)},
-            {"$set": {"updated_at": datetime.utcnow()}}
+        # Bump the project's updated_at off the request path
+        run_in_background(
+            projects_collection.update_one,
+            {"_id": _oid(project_id)},
+            {"$set": {"updated_at": now}}
         )
         
         logger.info(f"✅ Message saved to project {project_id}")
@@ -231,16 +367,44 @@ def save_message(project_id, role, content, data=None):
         return None
 
 
-def get_project_messages(project_id):
-    """Get all messages for a project"""
+def _project_messages_cursor(project_id, limit=None, before=None, include_data=True, batch_size=None):
+    """Cursor over a project's messages, with string ids.
+
+    Without a limit the cursor runs oldest first. With one it returns the
+    newest limit messages (older than the message id before, if given)
+    newest first, so callers reverse the page back into chronological order.
+    Pages are cut on _id, which is unique, so no message falls between two
+    pages the way same-second created_at values could.
+    """
+    query = {"project_id": project_id}
+    if before:
+        query["_id"] = {"$lt": ObjectId(before)}
+    projection = MESSAGE_PROJECTION if include_data else MESSAGE_SUMMARY_PROJECTION
+    
+    pipeline = [{"$match": query}]
+    if limit:
+        # One batch for the whole page instead of 101 docs + getMore
+        pipeline += [{"$sort": {"_id": DESCENDING}}, {"$limit": limit}]
+        batch_size = limit
+    else:
+        pipeline.append({"$sort": {"created_at": ASCENDING}})
+    pipeline += [{"$project": projection}, STRING_ID_STAGE]
+    
+    if batch_size:
+        return messages_collection.aggregate(pipeline, batchSize=batch_size)
+    return messages_collection.aggregate(pipeline)
+
+
+def get_project_messages(project_id, limit=None, before=None, include_data=True):
+    """Get messages for a project, oldest first.
+
+    With limit, only the latest limit messages older than the message id
+    `before` are returned, for paging backwards through long conversations.
+    """
     try:
-        messages = list(messages_collection.find(
-            {"project_id": project_id}
-        ).sort("created_at", ASCENDING))
-        
-        for message in messages:
-            message['_id'] = str(message['_id'])
-            message['id'] = str(message['_id'])
+        messages = list(_project_messages_cursor(project_id, limit, before, include_data))
+        if limit:
+            messages.reverse()
         
         logger.info(f"✅ Found {len(messages)} messages for project {project_id}")
         return messages
@@ -249,6 +413,52 @@ def get_project_messages(project_id):
         return []
 
 
+def get_project_messages_batch(user_id, project_ids):
+    """Get messages for several of a user's projects in one query.
+
+    Returns {project_id: [messages oldest first]}; ids that aren't valid or
+    don't belong to the user are left out.
+    """
+    try:
+        oids = [ObjectId(pid) for pid in project_ids if ObjectId.is_valid(pid)]
+        owned = [str(p['_id']) for p in projects_collection.find(
+            {"_id": {"$in": oids}, "user_id": user_id}, {"_id": 1}
+        )]
+        
+        grouped = {pid: [] for pid in owned}
+        if not owned:
+            return grouped
+        
+        cursor = messages_collection.aggregate([
+            {"$match": {"project_id": {"$in": owned}}},
+            {"$sort": {"created_at": ASCENDING}},
+            {"$project": {**MESSAGE_PROJECTION, "project_id": 1}},
+            STRING_ID_STAGE
+        ])
+        
+        for message in cursor:
+            grouped[message.pop('project_id')].append(message)
+        
+        logger.info(f"✅ Found messages for {len(grouped)} projects (batched)")
+        return grouped
+    except Exception as e:
+        logger.error(f"❌ Error getting batched messages: {str(e)}")
+        return None
+
+
+def iter_project_messages(project_id, limit=None, before=None, include_data=True, batch_size=200):
+    """Yield a project's messages oldest first without materializing the list.
+
+    limit/before page backwards like get_project_messages; a page is small
+    enough to be read whole and reversed.
+    """
+    cursor = _project_messages_cursor(project_id, limit, before, include_data, batch_size)
+    if limit:
+        yield from reversed(list(cursor))
+    else:
+        yield from cursor
+
+
 # ============== REPO CONTEXT OPERATIONS ==============
 
 def save_repo_context(repo_full_name, context_text, language=None, metadata=None):
@@ -328,8 +538,14 @@ def update_repo_context(repo_full_name, context_text):
 
 # ============== CONVERSATION HISTORY OPERATIONS ==============
 
+def set_history_summarizer(summarizer):
+    """Register the function used to summarize turns during compaction"""
+    global _history_summarizer
+    _history_summarizer = summarizer
+
+
 def save_conversation_history(session_id, prompt, analysis=None, plan=None):
-    """Save conversation history to database"""
+    """Save conversation history to database, compacting it once it grows too long"""
     try:
         conversation_entry = {
             "timestamp": datetime.utcnow(),
@@ -338,26 +554,89 @@ def save_conversation_history(session_id, prompt, analysis=None, plan=None):
             "plan": plan
         }
         
-        result = conversation_history_collection.update_one(
+        history = conversation_history_collection.find_one_and_update(
             {"session_id": session_id},
             {
                 "$push": {"conversations": conversation_entry},
                 "$setOnInsert": {"created_at": datetime.utcnow()}
             },
-            upsert=True
+            projection={"turns": {"$size": "$conversations"}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
         
         logger.info(f"✅ Conversation saved for session {session_id}")
+        
+        if history and history.get("turns", 0) > HISTORY_COMPACT_THRESHOLD:
+            _compaction_pool.submit(compact_conversation_history, session_id)
         return True
     except Exception as e:
         logger.error(f"❌ Error saving conversation history: {str(e)}")
         return False
 
 
-def get_conversation_history(session_id):
-    """Get conversation history from database"""
+def compact_conversation_history(session_id):
+    """Replace a session's oldest turns with one summary turn.
+
+    A compaction_lock field keeps concurrent writers from compacting the
+    same session twice. The rewrite is a single pipeline update that keeps
+    everything after the summarized turns, so turns pushed meanwhile survive.
+    """
+    if _history_summarizer is None:
+        return False
+    
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=HISTORY_COMPACT_LOCK_SECONDS)
+    locked = conversation_history_collection.update_one(
+        {"session_id": session_id, "$or": [
+            {"compaction_lock": {"$exists": False}},
+            {"compaction_lock": {"$lt": stale}}
+        ]},
+        {"$set": {"compaction_lock": now}}
+    )
+    if locked.modified_count == 0:
+        return False
+    
+    try:
+        history = conversation_history_collection.find_one(
+            {"session_id": session_id},
+            {"conversations": {"$slice": HISTORY_COMPACT_BATCH}}
+        )
+        turns = history.get("conversations", []) if history else []
+        if len(turns) < HISTORY_COMPACT_BATCH:
+            return False
+        
+        summary_entry = {
+            "timestamp": turns[-1].get("timestamp"),
+            "prompt": f"Summary of {len(turns)} earlier turns",
+            "summary": _history_summarizer(turns),
+            "analysis": None,
+            "plan": None
+        }
+        
+        conversation_history_collection.update_one(
+            {"session_id": session_id},
+            [{"$set": {"conversations": {"$concatArrays": [
+                [{"$literal": summary_entry}],
+                {"$slice": ["$conversations", len(turns), {"$max": [{"$size": "$conversations"}, 1]}]}
+            ]}}}]
+        )
+        logger.info(f"✅ Compacted {len(turns)} turns for session {session_id}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error compacting conversation history: {str(e)}")
+        return False
+    finally:
+        conversation_history_collection.update_one(
+            {"session_id": session_id}, {"$unset": {"compaction_lock": ""}}
+        )
+
+
+def get_conversation_history(session_id, limit=None):
+    """Get conversation history from database, optionally only the latest limit turns"""
     try:
-        history = conversation_history_collection.find_one({"session_id": session_id})
+        projection = {"conversations": {"$slice": -limit}} if limit else None
+        history = conversation_history_collection.find_one({"session_id": session_id}, projection)
         
         if history:
             history['_id'] = str(history['_id'])
@@ -370,27 +649,55 @@ def get_conversation_history(session_id):
         return {"conversations": []}
 
 
+# ============== LLM RESPONSE CACHE OPERATIONS ==============
+
+def get_cached_llm_response(cache_key):
+    """Get a cached LLM response payload, or None on a miss"""
+    try:
+        doc = llm_response_cache_collection.find_one({"cache_key": cache_key}, {"payload": 1, "_id": 0})
+        if doc:
+            logger.info(f"⚡ LLM cache hit for {cache_key[:12]}")
+            return doc["payload"]
+        return None
+    except Exception as e:
+        logger.error(f"❌ Error reading LLM cache: {str(e)}")
+        return None
+
+
+def save_cached_llm_response(cache_key, payload):
+    """Store an LLM response payload; the TTL index expires it after a day"""
+    try:
+        llm_response_cache_collection.update_one(
+            {"cache_key": cache_key},
+            {"$set": {"payload": payload, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return True
+    except Exception as e:
+        logger.error(f"❌ Error saving LLM cache: {str(e)}")
+        return False
+
+
 # ============== TASK OPERATIONS ==============
 
 def create_tasks(project_id, subtasks, session_id=None):
     """Create multiple tasks from AI-generated subtasks"""
     try:
-        task_ids = []
-        
-        for subtask in subtasks:
-            task = {
-                "project_id": project_id,
-                "title": subtask.get("task", ""),
-                "description": subtask.get("description", ""),
-                "priority": subtask.get("priority", "medium"),
-                "status": "pending",
-                "session_id": session_id,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
-            
-            result = tasks_collection.insert_one(task)
-            task_ids.append(str(result.inserted_id))
+        now = datetime.utcnow()
+        tasks = [{
+            "project_id": project_id,
+            "title": subtask.get("task", ""),
+            "description": subtask.get("description", ""),
+            "priority": subtask.get("priority", "medium"),
+            "status": "pending",
+            "session_id": session_id,
+            "created_at": now,
+            "updated_at": now
+        } for subtask in subtasks]
+        
+        # One round-trip for the whole batch
+        result = tasks_collection.insert_many(tasks, ordered=False)
+        task_ids = [str(task_id) for task_id in result.inserted_ids]
         
         logger.info(f"✅ Created {len(task_ids)} tasks for project {project_id}")
         return task_ids
@@ -399,19 +706,20 @@ def create_tasks(project_id, subtasks, session_id=None):
         return []
 
 
-def get_project_tasks(project_id, status_filter=None):
-    """Get all tasks for a project"""
+def get_project_tasks(project_id, status_filter=None, limit=None):
+    """Get tasks for a project, newest first, optionally capped at limit"""
     try:
         query = {"project_id": project_id}
         
         if status_filter:
             query["status"] = status_filter
         
-        tasks = list(tasks_collection.find(query).sort("created_at", DESCENDING))
+        pipeline = [{"$match": query}, {"$sort": {"created_at": DESCENDING}}]
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline += [{"$project": TASK_PROJECTION}, STRING_ID_STAGE]
         
-        for task in tasks:
-            task['_id'] = str(task['_id'])
-            task['id'] = str(task['_id'])
+        tasks = list(tasks_collection.aggregate(pipeline))
         
         logger.info(f"✅ Found {len(tasks)} tasks for project {project_id}")
         return tasks
@@ -426,7 +734,7 @@ def update_task(task_id, updates):
         updates['updated_at'] = datetime.utcnow()
         
         result = tasks_collection.update_one(
-            {"_id": ObjectId(task_id)},
+            {"_id": _oid(task_id)},
             {"$set": updates}
         )
         
@@ -442,7 +750,7 @@ def update_task(task_id, updates):
 def delete_task(task_id):
     """Delete a task"""
     try:
-        result = tasks_collection.delete_one({"_id": ObjectId(task_id)})
+        result = tasks_collection.delete_one({"_id": _oid(task_id)})
         
         if result.deleted_count > 0:
             logger.info(f"✅ Task {task_id} deleted")
@@ -0,0 +1,21 @@
+"""
+Redis Client for Feeta
+Optional shared store used when REDIS_URL is configured
+"""
+import logging
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def get_redis():
+    """Get the shared Redis client, or None when Redis is not configured"""
+    global _client
+    if _client is None and Config.REDIS_URL:
+        import redis
+        # unix:///path/to/redis.sock avoids TCP overhead on the same host
+        _client = redis.Redis.from_url(Config.REDIS_URL)
+        logger.info("✅ Redis client created")
+    return _client
@@ -1,101 +1,707 @@
 import os
-import requests
 import logging
-import json
 import re
+import hashlib
+import random
+import threading
+import time
 from datetime import datetime
+from string import Template
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from cachetools import TTLCache
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+from app.utils.background import run_in_background
+from app.utils.http import create_session, CONNECT_TIMEOUT, DEFAULT_TIMEOUT
+from app.services.semantic_cache import SemanticCache
+from app.database.redis_client import get_redis
 from app.database.mongodb import (
     save_repo_context, get_repo_context, update_repo_context,
-    save_conversation_history, get_conversation_history as db_get_conversation_history
+    save_conversation_history, get_conversation_history as db_get_conversation_history,
+    set_history_summarizer
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(name)s] - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_API_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent'
+GEMINI_STREAM_API_URL = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:streamGenerateContent'
 
-# Store sessions in memory (use Redis in production)
-task_sessions = {}
+# Gemini rate limits (429) and transient 5xx are retried inside call_gemini
+GEMINI_MAX_ATTEMPTS = 4
+GEMINI_BACKOFF_BASE = 0.5
+GEMINI_BACKOFF_MAX = 8
+_GEMINI_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Keep-alive pools so repeat calls skip the TCP + TLS handshake
+_gemini = create_session(pool_connections=2, pool_maxsize=50)
+_github = create_session(pool_connections=2, pool_maxsize=50)
+
+# Raw Gemini response text by digest of (prompt, generation config); an
+# identical prompt within the hour is answered without a network call
+_gemini_response_cache = TTLCache(maxsize=1024, ttl=3600)
+_gemini_response_cache_lock = threading.Lock()
+
+# Prompt input budgets, in characters (~4 per token)
+FILE_LIST_MAX_CHARS = 4000
+SLACK_TRANSCRIPT_MAX_CHARS = 16000
+SLACK_SUMMARY_MAX_MESSAGES = 200
+
+# Generated, vendored and binary paths that tell the model nothing about the architecture
+_NOISE_PATH_RE = re.compile(
+    r'(^|/)(node_modules|dist|build|vendor|\.git|__pycache__|\.next|coverage)/'
+    r'|\.(lock|min\.js|min\.css|map|png|jpe?g|gif|svg|ico|woff2?|ttf|pdf|zip)$'
+    r'|(^|/)(package-lock\.json|yarn\.lock|pnpm-lock\.yaml|poetry\.lock|Cargo\.lock)$'
+)
+
+# Paths that usually define what a project is and how it is wired together
+_KEY_FILE_NAMES = frozenset({
+    'main.py', 'app.py', 'manage.py', 'setup.py', 'pyproject.toml', 'requirements.txt',
+    'package.json', 'Cargo.toml', 'go.mod', 'pom.xml', 'build.gradle', 'Dockerfile',
+    'docker-compose.yml', 'index.js', 'index.ts', 'main.go', 'main.rs'
+})
+_SOURCE_DIRS = frozenset({'src', 'app', 'lib', 'server', 'backend', 'frontend', 'api', 'pkg', 'cmd'})
+
+# Slack mentions/links and :emoji: codes, ignored when spotting repeated messages
+_SLACK_MARKUP_RE = re.compile(r'<[@#!][^>]*>|:[a-z0-9_+\-]+:')
+
+# Prompt instructions are static and go first, with per-request context and
+# the task appended after them, so every call shares a byte-identical prefix
+# that the provider's prompt cache can reuse.
+TASK_TYPE_INSTRUCTIONS = """Analyze the task below with full project context.
+
+Determine:
+1. Is this adding a NEW feature that doesn't exist?
+2. Is this UPDATING/MODIFYING an existing feature?
+3. Is it BOTH (adding new + modifying existing)?
+
+Extract keywords that might exist in the codebase (e.g., "dashboard", "payment", "login").
+
+CRITICAL: Return ONLY valid JSON. No markdown, no code blocks, no extra text.
+Do not use trailing commas. Ensure all strings are properly quoted.
+
+Respond with valid JSON:
+{
+  "task_type": "new" | "update" | "both",
+  "keywords": ["keyword1", "keyword2"],
+  "reasoning": "Brief explanation"
+}"""
+
+CLARITY_INSTRUCTIONS = """Analyze if the task below is clear enough to implement.
+
+Rules:
+1. If task type is "update" or "both" but NO existing code found → Ask questions about what exists
+2. If task is vague (e.g., "get dashboard ready") → Ask specific questions
+3. If task is clear and specific → Mark as clear
+
+When asking questions, provide a helpful explanation for WHY each question matters.
+
+CRITICAL: Return ONLY valid JSON. No markdown, no code blocks, no extra text.
+Do not use trailing commas. Ensure all strings are properly quoted.
+
+Respond with valid JSON in this format:
+{"status": "clear", "analysis": "Task is clear"}
+OR
+{
+  "status": "ambiguous", 
+  "questions": [
+    {
+      "question": "What specific AI model should be used?",
+      "explanation": "Different AI models have different capabilities and costs. This helps us choose the right tool for your needs."
+    }
+  ]
+}"""
+
+PLAN_INSTRUCTIONS = """You are a senior project manager. Create a detailed implementation plan for the task below.
+
+Instructions:
+- If task type is "new": Create plan for building from scratch
+- If task type is "update": Focus on modifying existing code in the files listed
+- If task type is "both": Plan for both new features and modifications
+
+Create 5-7 specific subtasks with:
+- Clear, actionable title
+- Detailed description
+- Suggested role (Frontend Dev, Backend Dev, Designer, etc.)
+- Realistic deadline (Day 1, Day 2, etc.)
+- Expected output/deliverable
+- Clarity score (0-100)
+
+Return ONLY valid JSON:
+{
+  "main_task": "Task Title",
+  "goal": "What we're achieving",
+  "task_type": "new" | "update" | "both" (the Task Type given below),
+  "subtasks": [
+    {
+      "title": "Subtask name",
+      "description": "Detailed steps",
+      "assigned_to": "Role",
+      "deadline": "Day X",
+      "output": "Deliverable",
+      "clarity_score": 95
+    }
+  ]
+}"""
+
+# Full prompts: the static instructions above plus per-request slots, built
+# once here and filled with Template.substitute at each call
+TASK_TYPE_PROMPT = Template(TASK_TYPE_INSTRUCTIONS + """
+
+$context_text
+
+Task: "$task"
+""")
+
+CLARITY_PROMPT = Template(CLARITY_INSTRUCTIONS + """
+
+$context_text
+
+Task: "$task"
+Task Type: $task_type
+$findings_text""")
+
+PLAN_PROMPT = Template(PLAN_INSTRUCTIONS + """
+
+Task: "$task"
+Task Type: $task_type
+$clarifications_text
+$findings_text""")
+
+DEEP_CONTEXT_PROMPT = Template("""You are a 10x Senior Solutions Architect. Perform a deep analysis of this GitHub repository to create a comprehensive "Project Context" summary.
+
+**Repository Information:**
+---
+**Directory Overview:**
+$directory_overview
+
+**Key Files:**
+$file_list_str
+
+**README.md:**
+$readme_content
+---
+
+Analyze and generate a JSON object with:
+
+1. `project_summary`: One-paragraph description of the project's purpose
+2. `tech_stack`: Object with keys: `language`, `framework_backend`, `framework_frontend`, `database`, `key_libraries`
+3. `architecture_overview`: Brief architecture description (e.g., "Monolithic MVC", "Microservices")
+4. `key_modules`: Array of core features/modules. For each:
+   - `module_name`: Name of the module
+   - `description`: What this module does
+   - `relevant_files`: Top 3-5 most important file paths for this module
+
+Do not guess. Prioritize accuracy.
+
+Respond ONLY with valid JSON:
+{
+  "project_summary": "...",
+  "tech_stack": {
+    "language": "...",
+    "framework_backend": "...",
+    "framework_frontend": "...",
+    "database": "...",
+    "key_libraries": ["..."]
+  },
+  "architecture_overview": "...",
+  "key_modules": [
+    {
+      "module_name": "...",
+      "description": "...",
+      "relevant_files": ["..."]
+    }
+  ]
+}""")
+
+SLACK_SUMMARY_PROMPT = Template("""Analyze the following Slack channel conversation and provide a concise summary.
+
+SLACK MESSAGES:
+$conversation_text
+
+Generate a JSON response with this structure:
+{
+  "key_updates": [
+    {"user": "User Name", "update": "Brief description of what they said/did"},
+    ...
+  ],
+  "active_users": ["List of users who participated"],
+  "blockers": ["Any blockers or issues mentioned"],
+  "progress_indicators": ["Any progress updates or completed tasks"],
+  "overall_status": "A one-sentence summary of the channel activity",
+  "sentiment": "positive/neutral/negative",
+  "action_items": ["Any action items or next steps mentioned"]
+}
+
+Keep updates brief (max 15 words each). Return ONLY valid JSON, no markdown, no code blocks.""")
+
+HISTORY_SUMMARY_PROMPT = Template("""Summarize these earlier requests from a task-planning conversation in at most 5 sentences. Keep project names, features and decisions. Return plain text only.
+
+$turns""")
+
+# Pool for concurrent GitHub reads (keyword searches, repo tree/README/metadata)
+_github_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gh-fetch")
+
+# Deep project contexts by repo full name, in front of the repo_contexts
+# collection so hot repos don't cost a Mongo round-trip per analysis
+_repo_context_cache = TTLCache(maxsize=256, ttl=300)
+_repo_context_cache_lock = threading.Lock()
+
+# Plans for the same task reworded only in case, punctuation or filler words,
+# within one session and with the same task type, answers and findings, are
+# served without a Gemini call
+_plan_semantic_cache = SemanticCache()
+
+# Analyses awaiting plan generation, by session id. Stored in Redis when it
+# is configured so any worker can pick the session up; otherwise in-process.
+TASK_SESSION_TTL_SECONDS = 3600
+task_sessions = TTLCache(maxsize=10000, ttl=TASK_SESSION_TTL_SECONDS)
+_task_sessions_lock = threading.Lock()
+
+def store_task_session(session_id, data):
+    """Save a session's task state for TASK_SESSION_TTL_SECONDS"""
+    redis_client = get_redis()
+    if redis_client is not None:
+        try:
+            redis_client.setex(
+                f"task:{session_id}", TASK_SESSION_TTL_SECONDS, orjson.dumps(data, default=str)
+            )
+            return
+        except Exception as e:
+            logger.error(f"❌ Redis session write failed, keeping it in-process: {str(e)}")
+    with _task_sessions_lock:
+        task_sessions[session_id] = data
+
+def load_task_session(session_id):
+    """Get a session's task state, or None if unknown or expired"""
+    redis_client = get_redis()
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(f"task:{session_id}")
+            if raw is not None:
+                return orjson.loads(raw)
+        except Exception as e:
+            logger.error(f"❌ Redis session read failed: {str(e)}")
+    with _task_sessions_lock:
+        return task_sessions.get(session_id)
 
 def add_to_history(session_id, prompt, analysis=None, plan=None):
-    """Add a prompt and its results to conversation history (database)"""
-    try:
-        save_conversation_history(session_id, prompt, analysis, plan)
-        logger.info(f"💾 Added to database history for session {session_id}")
-    except Exception as e:
-        logger.error(f"❌ Error saving to history: {str(e)}")
+    """Add a prompt and its results to conversation history (database).
+
+    The write runs on the background pool so the response isn't held up;
+    save_conversation_history logs its own failures.
+    """
+    run_in_background(save_conversation_history, session_id, prompt, analysis, plan)
+    logger.info(f"💾 Queued history write for session {session_id}")
+
+def remember_analysis(session_id, task, analysis):
+    """Record an analysis for the session so plan generation can use it"""
+    store_task_session(session_id, {
+        'task': task,
+        'analysis': analysis,
+        'created_at': datetime.utcnow()
+    })
+    logger.info(f"💾 Session stored: {session_id}")
+    
+    # Add to conversation history
+    add_to_history(session_id, task, analysis=analysis)
+
+class _JsonObjectTracker:
+    """Incrementally tracks when the first top-level JSON object in a text stream closes"""
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk):
+        """Consume the next piece of text; True once the object is complete"""
+        for ch in chunk:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.started
+            elif ch == '{':
+                self.depth += 1
+                self.started = True
+            elif ch == '}' and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+def _check_gemini_payload(data, context):
+    """Raise a descriptive error for a Gemini error or empty/blocked response"""
+    # Check for errors in response
+    if 'error' in data:
+        error_msg = data['error'].get('message', 'Unknown error')
+        logger.error(f"❌ Gemini API Error: {error_msg}")
+        raise Exception(f"Gemini API error: {error_msg}")
+    
+    # Check if candidates exist
+    if 'candidates' not in data or not data['candidates']:
+        logger.error(f"❌ No candidates in {context}: {orjson.dumps(data).decode()}")
+        # Check for safety filters or other issues
+        if 'promptFeedback' in data:
+            feedback = data['promptFeedback']
+            logger.error(f"⚠️ Prompt Feedback: {orjson.dumps(feedback).decode()}")
+            if 'blockReason' in feedback:
+                raise Exception(f"Content blocked by safety filters: {feedback['blockReason']}")
+        raise Exception(f"Gemini API returned no candidates for {context}")
+
+def _post_gemini(url, params, prompt, generation_config, timeout, context, stream=False):
+    """POST a prompt to Gemini, retrying rate limits and transient server errors.
+
+    Waits Retry-After when Gemini sends it, otherwise exponential backoff
+    with full jitter; only this call is retried, not the caller's pipeline.
+    Connection errors and timeouts are retried the same way. The last
+    response is returned as-is once attempts run out.
+    """
+    for attempt in range(1, GEMINI_MAX_ATTEMPTS + 1):
+        try:
+            response = _gemini.post(
+                url,
+                headers={'Content-Type': 'application/json'},
+                params={'key': GEMINI_API_KEY, **params},
+                json={
+                    'contents': [{'parts': [{'text': prompt}]}],
+                    'generationConfig': generation_config
+                },
+                timeout=(CONNECT_TIMEOUT, timeout),
+                stream=stream
+            )
+        except (RequestsConnectionError, Timeout) as e:
+            if attempt == GEMINI_MAX_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+            logger.warning(f"⚠️ Gemini {context} request failed ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        
+        if response.status_code not in _GEMINI_RETRY_STATUSES or attempt == GEMINI_MAX_ATTEMPTS:
+            return response
+        
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            delay = min(int(retry_after), GEMINI_BACKOFF_MAX)
+        else:
+            delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+        response.close()
+        logger.warning(f"⚠️ Gemini {context} returned {response.status_code}, retry {attempt} in {delay:.1f}s")
+        time.sleep(delay)
+
+def _stream_gemini_json(prompt, generation_config, timeout, context):
+    """Stream a response over SSE and hang up once its JSON object is complete.
+
+    Anything the model would append after the object (explanations, code
+    fences) is never generated or downloaded.
+    """
+    response = _post_gemini(
+        GEMINI_STREAM_API_URL, {'alt': 'sse'}, prompt, generation_config, timeout, context, stream=True
+    )
+    
+    with response:
+        if response.status_code != 200:
+            _check_gemini_payload(orjson.loads(response.content), context)
+            raise Exception(f"Gemini API returned status {response.status_code}")
+        
+        tracker = _JsonObjectTracker()
+        parts = []
+        for line in response.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            data = orjson.loads(line[5:])
+            if not parts:
+                _check_gemini_payload(data, context)
+            candidate = (data.get('candidates') or [{}])[0]
+            chunk = ''.join(p.get('text', '') for p in candidate.get('content', {}).get('parts', []))
+            parts.append(chunk)
+            if tracker.feed(chunk):
+                logger.info(f"✂️ Stopped {context} stream once the JSON object closed")
+                break
+    
+    text = ''.join(parts)
+    if not text:
+        raise Exception(f"Gemini API returned no candidates for {context}")
+    return text
+
+def call_gemini(prompt, generation_config, timeout=60, context="response", use_cache=True, stream_json=False,
+                parse=None):
+    """Send a single-turn prompt to Gemini and return the response text.
+
+    Raises with a descriptive message on API errors, blocked prompts or an
+    empty candidate list, so callers only deal with the happy path.
+    With parse, returns parse(text) instead, and a response is only cached
+    once it parses, so a malformed or truncated reply is never reused.
+    Responses are reused for byte-identical prompts and config;
+    use_cache=False skips that lookup and replaces the cached response with
+    the fresh one. With stream_json, the response is streamed and cut off
+    as soon as it contains a complete JSON object.
+    """
+    raw = prompt.encode() + orjson.dumps(generation_config, option=orjson.OPT_SORT_KEYS)
+    cache_key = hashlib.sha256(raw).digest()
+    if use_cache:
+        with _gemini_response_cache_lock:
+            cached = _gemini_response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Exact prompt cache hit ({context})")
+            return parse(cached) if parse else cached
+    
+    if stream_json:
+        text = _stream_gemini_json(prompt, generation_config, timeout, context)
+    else:
+        response = _post_gemini(GEMINI_API_URL, {}, prompt, generation_config, timeout, context)
+        data = orjson.loads(response.content)
+        _check_gemini_payload(data, context)
+        text = data['candidates'][0]['content']['parts'][0]['text']
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📝 %s response: %s", context, text[:500])
+    
+    result = parse(text) if parse else text
+    with _gemini_response_cache_lock:
+        _gemini_response_cache[cache_key] = text
+    return result
+
+def summarize_history_turns(turns):
+    """Condense conversation turns into a short summary for history compaction"""
+    lines = []
+    for turn in turns:
+        line = f"- {turn.get('summary') or turn.get('prompt', '')}"
+        analysis = turn.get('analysis') or {}
+        if isinstance(analysis, dict) and analysis.get('status'):
+            line += f" (analysis: {analysis['status']})"
+        if turn.get('plan'):
+            line += " (plan generated)"
+        lines.append(line)
+    
+    prompt = HISTORY_SUMMARY_PROMPT.substitute(turns='\n'.join(lines))
+    
+    text = call_gemini(prompt, {'temperature': 0.2, 'maxOutputTokens': 256}, timeout=30, context="history summary")
+    return text.strip()
+
+set_history_summarizer(summarize_history_turns)
 
-def get_conversation_history(session_id):
+def get_conversation_history(session_id, limit=None):
     """Retrieve conversation history for a session (from database)"""
     try:
-        return db_get_conversation_history(session_id)
+        return db_get_conversation_history(session_id, limit)
     except Exception as e:
         logger.error(f"❌ Error getting history: {str(e)}")
         return {'conversations': []}
 
+def rank_file(path):
+    """Heuristic score of how much a path says about a repo's architecture"""
+    name = path.rpartition('/')[2]
+    score = 0
+    if name in _KEY_FILE_NAMES or name.startswith('README'):
+        score += 5
+    if path.partition('/')[0] in _SOURCE_DIRS:
+        score += 3
+    if _NOISE_PATH_RE.search(path):
+        score -= 5
+    # Shallow files (entry points, configs) outrank deeply nested ones
+    return score - min(path.count('/'), 4)
+
+def pick_informative_files(files, max_files=80, max_chars=FILE_LIST_MAX_CHARS):
+    """Highest-ranked non-noise paths that fit the prompt budget, in tree order"""
+    ranked = sorted(
+        (i for i, path in enumerate(files) if not _NOISE_PATH_RE.search(path)),
+        key=lambda i: -rank_file(files[i])
+    )
+    chosen = []
+    used = 0
+    for i in ranked[:max_files]:
+        used += len(files[i]) + 2
+        if used > max_chars:
+            break
+        chosen.append(i)
+    return [files[i] for i in sorted(chosen)]
+
+def summarize_directories(files, top=10):
+    """One "dir/ (N files)" line per largest top-level directory"""
+    counts = {}
+    for path in files:
+        head, sep, _ = path.partition('/')
+        if sep and not _NOISE_PATH_RE.search(path):
+            counts[head] = counts.get(head, 0) + 1
+    largest = sorted(counts.items(), key=lambda item: -item[1])[:top]
+    return "\n".join(f"- {folder}/ ({count} files)" for folder, count in largest)
+
+def build_slack_transcript(messages, max_messages=SLACK_SUMMARY_MAX_MESSAGES, max_chars=SLACK_TRANSCRIPT_MAX_CHARS):
+    """Render messages as "user: text" lines within a prompt budget.
+
+    Only the first max_messages are used (Slack returns newest first),
+    repeats of a message by the same user ("+1", recurring bot alerts) are
+    kept once, and consecutive messages from the same user share one line.
+    """
+    lines = []
+    seen = set()
+    last_user = None
+    used = 0
+    for msg in messages[:max_messages]:
+        user = msg.get('user', 'Unknown')
+        text = msg.get('text', '').strip()
+        key = (user, ' '.join(_SLACK_MARKUP_RE.sub('', text).lower().split()))
+        if not key[1] or key in seen:
+            continue
+        seen.add(key)
+        if user == last_user:
+            lines[-1] += f" / {text}"
+        else:
+            lines.append(f"{user}: {text}")
+            last_user = user
+        used += len(text) + len(user) + 3
+        if used > max_chars:
+            break
+    return "\n".join(lines) + "\n"
+
+def repair_json_text(text):
+    """Strip // and /* */ comments and trailing commas in a single pass.
+
+    String literals are copied verbatim, so URLs and other "//" inside
+    values survive. A comma is dropped when the next significant character
+    closes an object or array.
+    """
+    out = []
+    append = out.append
+    i, n = 0, len(text)
+    pending_comma = False
+    while i < n:
+        ch = text[i]
+        if ch == '"':
+            # Copy the whole string literal, honouring escapes
+            j = i + 1
+            while j < n and text[j] != '"':
+                j += 2 if text[j] == '\\' else 1
+            if pending_comma:
+                append(',')
+                pending_comma = False
+            append(text[i:j + 1])
+            i = j + 1
+            continue
+        if ch == '/' and i + 1 < n and text[i + 1] in '/*':
+            end = text.find('\n' if text[i + 1] == '/' else '*/', i + 2)
+            if end == -1:
+                break
+            # Keep the newline that ends a line comment
+            i = end if text[i + 1] == '/' else end + 2
+            continue
+        if ch == ',':
+            if pending_comma:
+                append(',')
+            pending_comma = True
+        elif ch in ' \t\r\n':
+            append(ch)
+        else:
+            if pending_comma and ch not in '}]':
+                append(',')
+            pending_comma = False
+            append(ch)
+        i += 1
+    if pending_comma:
+        append(',')
+    return ''.join(out)
+
+def _extract_json_span(text):
+    """Return the first balanced {...} object in text, or None if there is no '{'.
+
+    Braces inside string literals are ignored, so stray braces in prose
+    after the object don't widen the match. A truncated object falls back
+    to everything up to the last '}' so repair still gets a chance.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    end = text.rfind('}')
+    return text[start:end + 1] if end > start else None
+
 def parse_json_from_text(text, context="response"):
     """Extract and parse JSON from text with error recovery"""
     try:
         # Try to find JSON in the text
-        json_match = re.search(r'\{[\s\S]*\}', text)
-        if not json_match:
+        json_str = _extract_json_span(text)
+        if not json_str:
             logger.error(f"❌ Could not find JSON in {context}")
             raise Exception(f"No JSON found in {context}")
         
-        json_str = json_match.group()
         logger.info(f"📝 Extracted JSON ({len(json_str)} chars)")
         
         # Try to parse the JSON
         try:
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError as e:
             logger.error(f"❌ JSON Parse Error at position {e.pos}: {e.msg}")
             logger.error(f"📄 Problematic JSON snippet: ...{json_str[max(0, e.pos-100):min(len(json_str), e.pos+100)]}...")
             
-            # Try to fix common JSON errors
-            # Remove trailing commas before } or ]
-            fixed_json = re.sub(r',(\s*[}\]])', r'\1', json_str)
-            # Remove comments if any
-            fixed_json = re.sub(r'//.*?\n', '\n', fixed_json)
-            fixed_json = re.sub(r'/\*.*?\*/', '', fixed_json, flags=re.DOTALL)
+            # Try to fix common JSON errors (comments, trailing commas)
+            fixed_json = repair_json_text(json_str)
             
             try:
                 logger.info("🔧 Attempting to fix JSON errors...")
-                return json.loads(fixed_json)
-            except json.JSONDecodeError as e2:
+                return orjson.loads(fixed_json)
+            except orjson.JSONDecodeError as e2:
                 logger.error(f"❌ Could not fix JSON automatically")
-                logger.error(f"📄 Full malformed JSON:\n{json_str[:1000]}...")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("📄 Full malformed JSON: %s", json_str[:1000])
                 raise Exception(f"Invalid JSON in {context}: {e.msg} at position {e.pos}")
     except Exception as e:
         logger.error(f"❌ JSON extraction failed: {str(e)}")
         raise
 
+def search_code_for_keyword(owner, repo, keyword, headers):
+    """Search a repository for one keyword; returns up to 5 matching files"""
+    search_url = f"https://api.github.com/search/code?q={keyword}+repo:{owner}/{repo}"
+    resp = _github.get(search_url, headers=headers, timeout=DEFAULT_TIMEOUT)
+    
+    if resp.status_code != 200:
+        logger.warning(f"⚠️ Search failed for '{keyword}': {resp.status_code}")
+        return []
+    
+    items = orjson.loads(resp.content).get('items', [])[:5]
+    logger.info(f"✅ Found {len(items)} files with '{keyword}'")
+    return [{
+        'file': item['path'],
+        'keyword': keyword,
+        'url': item['html_url']
+    } for item in items]
+
 def search_codebase_for_keywords(owner, repo, keywords, github_token=None):
-    """Search GitHub repository for specific keywords"""
+    """Search GitHub repository for specific keywords, one concurrent search per keyword"""
     logger.info(f"🔍 Searching codebase for: {keywords}")
     
     try:
         headers = {'Authorization': f'token {github_token}'} if github_token else {}
-        search_results = []
+        keywords = keywords[:3]  # Limit to 3 keywords
         
-        for keyword in keywords[:3]:  # Limit to 3 keywords
-            search_url = f"https://api.github.com/search/code?q={keyword}+repo:{owner}/{repo}"
-            resp = requests.get(search_url, headers=headers, timeout=10)
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                items = data.get('items', [])[:5]
-                for item in items:
-                    search_results.append({
-                        'file': item['path'],
-                        'keyword': keyword,
-                        'url': item['html_url']
-                    })
-                logger.info(f"✅ Found {len(items)} files with '{keyword}'")
-            else:
-                logger.warning(f"⚠️ Search failed for '{keyword}': {resp.status_code}")
-        
-        return search_results
+        results = _github_pool.map(lambda kw: search_code_for_keyword(owner, repo, kw, headers), keywords)
+        return [match for matches in results for match in matches]
     except Exception as e:
         logger.error(f"❌ Codebase search error: {str(e)}")
         return []
@@ -128,68 +734,16 @@ def analyze_task_with_llm(task, session_id=None, repo_context=None, owner=None,
     # Step 1: Detect task type with project context
     logger.info("🔍 Step 1A: Detecting task type with project context...")
     
-    type_detection_prompt = f"""Analyze this task with full project context.
-
-{context_text}
-
-Task: "{task}"
-
-Task: "{task}"
-
-Determine:
-1. Is this adding a NEW feature that doesn't exist?
-2. Is this UPDATING/MODIFYING an existing feature?
-3. Is it BOTH (adding new + modifying existing)?
-
-Extract keywords that might exist in the codebase (e.g., "dashboard", "payment", "login").
-
-CRITICAL: Return ONLY valid JSON. No markdown, no code blocks, no extra text.
-Do not use trailing commas. Ensure all strings are properly quoted.
-
-Respond with valid JSON:
-{{
-  "task_type": "new" | "update" | "both",
-  "keywords": ["keyword1", "keyword2"],
-  "reasoning": "Brief explanation"
-}}"""
+    type_detection_prompt = TASK_TYPE_PROMPT.substitute(context_text=context_text, task=task)
     
     try:
-        api_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent'
-        
         # Detect task type
         logger.info("🚀 Calling Gemini for task type detection...")
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            params={'key': GEMINI_API_KEY},
-            json={
-                'contents': [{'parts': [{'text': type_detection_prompt}]}],
-                'generationConfig': {'temperature': 0.3, 'maxOutputTokens': 512}
-            },
-            timeout=60
+        task_type_info = call_gemini(
+            type_detection_prompt, {'temperature': 0.3, 'maxOutputTokens': 512}, context="task type detection",
+            parse=lambda text: parse_json_from_text(text, "task type detection")
         )
         
-        data = response.json()
-        
-        # Check for errors in response
-        if 'error' in data:
-            error_msg = data['error'].get('message', 'Unknown error')
-            logger.error(f"❌ Gemini API Error: {error_msg}")
-            raise Exception(f"Gemini API error: {error_msg}")
-        
-        # Check if candidates exist
-        if 'candidates' not in data or not data['candidates']:
-            logger.error(f"❌ No candidates in response. Full response: {json.dumps(data)}")
-            if 'promptFeedback' in data:
-                feedback = data['promptFeedback']
-                logger.error(f"⚠️ Prompt Feedback: {json.dumps(feedback)}")
-            raise Exception("Gemini API returned no candidates")
-        
-        text = data['candidates'][0]['content']['parts'][0]['text']
-        logger.info(f"📝 Task Type Response: {text[:500]}...")
-        
-        task_type_info = parse_json_from_text(text, "task type detection")
-        
         logger.info(f"✅ Task Type: {task_type_info['task_type']}")
         logger.info(f"🔑 Keywords: {task_type_info['keywords']}")
         logger.info(f"💡 Reasoning: {task_type_info['reasoning']}")
@@ -225,91 +779,26 @@ Repository Info:
         elif task_type_info['task_type'] in ['update', 'both']:
             findings_text = "\n\n⚠️ WARNING: Task mentions updating existing features, but NO related code was found in the repository!"
         
-        clarity_prompt = f"""Analyze if this task is clear enough to implement.
-
-{context_text}
-
-Task: "{task}"
-Task Type: {task_type_info['task_type']}
-{findings_text}
-
-Rules:
-1. If task type is "update" or "both" but NO existing code found → Ask questions about what exists
-2. If task is vague (e.g., "get dashboard ready") → Ask specific questions
-3. If task is clear and specific → Mark as clear
-
-When asking questions, provide a helpful explanation for WHY each question matters.
-
-CRITICAL: Return ONLY valid JSON. No markdown, no code blocks, no extra text.
-Do not use trailing commas. Ensure all strings are properly quoted.
-
-Respond with valid JSON in this format:
-{{"status": "clear", "analysis": "Task is clear"}}
-OR
-{{
-  "status": "ambiguous", 
-  "questions": [
-    {{
-      "question": "What specific AI model should be used?",
-      "explanation": "Different AI models have different capabilities and costs. This helps us choose the right tool for your needs."
-    }}
-  ]
-}}"""
+        clarity_prompt = CLARITY_PROMPT.substitute(
+            context_text=context_text, task=task, task_type=task_type_info['task_type'], findings_text=findings_text
+        )
         
         logger.info("🚀 Calling Gemini for clarity analysis...")
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            params={'key': GEMINI_API_KEY},
-            json={
-                'contents': [{'parts': [{'text': clarity_prompt}]}],
-                'generationConfig': {'temperature': 0.4, 'maxOutputTokens': 512}
-            },
-            timeout=60
+        result = call_gemini(
+            clarity_prompt, {'temperature': 0.4, 'maxOutputTokens': 512}, context="clarity analysis",
+            parse=lambda text: parse_json_from_text(text, "clarity analysis")
         )
         
-        data = response.json()
-        logger.info(f"📦 Gemini Response: {json.dumps(data, indent=2)}")
-        
-        # Check for errors in response
-        if 'error' in data:
-            error_msg = data['error'].get('message', 'Unknown error')
-            logger.error(f"❌ Gemini API Error: {error_msg}")
-            raise Exception(f"Gemini API error: {error_msg}")
-        
-        # Check if candidates exist
-        if 'candidates' not in data or not data['candidates']:
-            logger.error(f"❌ No candidates in response. Full response: {json.dumps(data)}")
-            # Check for safety filters or other issues
-            if 'promptFeedback' in data:
-                feedback = data['promptFeedback']
-                logger.error(f"⚠️ Prompt Feedback: {json.dumps(feedback)}")
-                if 'blockReason' in feedback:
-                    raise Exception(f"Content blocked by safety filters: {feedback['blockReason']}")
-            raise Exception("Gemini API returned no candidates. This might be due to safety filters or API issues.")
-        
-        text = data['candidates'][0]['content']['parts'][0]['text']
-        logger.info(f"📝 Clarity Analysis Response: {text[:500]}...")
-        
-        result = parse_json_from_text(text, "clarity analysis")
-        
         # Add task type info to result
         result['task_type'] = task_type_info['task_type']
         result['keywords'] = task_type_info['keywords']
         result['codebase_findings'] = codebase_findings
         
-        logger.info(f"✨ Final Analysis: {json.dumps(result, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("✨ Final Analysis: %s", orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
         
         if session_id:
-            task_sessions[session_id] = {
-                'task': task,
-                'analysis': result,
-                'created_at': datetime.utcnow()
-            }
-            logger.info(f"💾 Session stored: {session_id}")
-            
-            # Add to conversation history
-            add_to_history(session_id, task, analysis=result)
+            remember_analysis(session_id, task, result)
         
         logger.info("="*60)
         logger.info(f"✅ ANALYSIS COMPLETE - Status: {result.get('status')}")
@@ -330,11 +819,20 @@ def create_deep_project_context(owner, repo, github_token=None):
     repo_full_name = f"{owner}/{repo}"
     logger.info(f"📦 Repository: {repo_full_name}")
     
-    # ✨ CHECK DATABASE CACHE FIRST
+    # ✨ CHECK PROCESS AND DATABASE CACHES FIRST
+    cache_key = repo_full_name.lower()
+    with _repo_context_cache_lock:
+        context = _repo_context_cache.get(cache_key)
+    if context is not None:
+        logger.info("⚡ Using in-process repo context")
+        return context
+    
     cached_context = get_repo_context(repo_full_name)
     if cached_context:
         logger.info(f"⚡ Using cached repo context (accessed {cached_context.get('access_count', 0)} times)")
         logger.info(f"📅 Cache age: {cached_context.get('updated_at', 'unknown')}")
+        with _repo_context_cache_lock:
+            _repo_context_cache[cache_key] = cached_context['context_text']
         return cached_context['context_text']
     
     logger.info("🔄 Cache miss - performing fresh analysis...")
@@ -342,109 +840,47 @@ def create_deep_project_context(owner, repo, github_token=None):
     try:
         headers = {'Authorization': f'token {github_token}'} if github_token else {}
         
-        # Fetch complete file tree
-        logger.info("🔍 Fetching complete file tree...")
-        tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/main?recursive=1"
-        tree_resp = requests.get(tree_url, headers=headers, timeout=60)
+        # Fetch the tree (guessing "main"), README and repo metadata at once;
+        # the metadata names the real default branch if the guess misses
+        logger.info("🔍 Fetching file tree, README and repo metadata...")
+        repo_url = f"https://api.github.com/repos/{owner}/{repo}"
+        tree_future = _github_pool.submit(
+            _github.get, f"{repo_url}/git/trees/main?recursive=1", headers=headers, timeout=(CONNECT_TIMEOUT, 60)
+        )
+        readme_future = _github_pool.submit(_github.get, f"{repo_url}/readme", headers=headers, timeout=DEFAULT_TIMEOUT)
+        meta_future = _github_pool.submit(_github.get, repo_url, headers=headers, timeout=DEFAULT_TIMEOUT)
         
+        tree_resp = tree_future.result()
         if tree_resp.status_code != 200:
-            tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/master?recursive=1"
-            tree_resp = requests.get(tree_url, headers=headers, timeout=15)
+            meta_resp = meta_future.result()
+            default_branch = orjson.loads(meta_resp.content).get('default_branch') if meta_resp.status_code == 200 else None
+            tree_url = f"{repo_url}/git/trees/{default_branch or 'master'}?recursive=1"
+            tree_resp = _github.get(tree_url, headers=headers, timeout=(CONNECT_TIMEOUT, 15))
         
-        tree_data = tree_resp.json()
+        tree_data = orjson.loads(tree_resp.content)
         all_files = [f['path'] for f in tree_data.get('tree', []) if f['type'] == 'blob']
         logger.info(f"📂 Found {len(all_files)} files")
         
-        # Fetch README
-        logger.info("📄 Fetching README...")
-        readme_url = f"https://api.github.com/repos/{owner}/{repo}/readme"
-        readme_resp = requests.get(readme_url, headers=headers, timeout=10)
+        readme_resp = readme_future.result()
         readme_content = ""
         if readme_resp.status_code == 200:
             import base64
-            readme_content = base64.b64decode(readme_resp.json()['content']).decode('utf-8')[:3000]
+            readme_content = base64.b64decode(orjson.loads(readme_resp.content)['content']).decode('utf-8')[:3000]
             logger.info("✅ README fetched")
         
         # Deep analysis prompt
-        file_list_str = ", ".join(all_files[:100])  # First 100 files
+        file_list_str = ", ".join(pick_informative_files(all_files))
+        directory_overview = summarize_directories(all_files)
         
-        prompt = f"""You are a 10x Senior Solutions Architect. Perform a deep analysis of this GitHub repository to create a comprehensive "Project Context" summary.
-
-**Repository Information:**
----
-**File Tree:**
-{file_list_str}
-
-**README.md:**
-{readme_content}
----
-
-Analyze and generate a JSON object with:
-
-1. `project_summary`: One-paragraph description of the project's purpose
-2. `tech_stack`: Object with keys: `language`, `framework_backend`, `framework_frontend`, `database`, `key_libraries`
-3. `architecture_overview`: Brief architecture description (e.g., "Monolithic MVC", "Microservices")
-4. `key_modules`: Array of core features/modules. For each:
-   - `module_name`: Name of the module
-   - `description`: What this module does
-   - `relevant_files`: Top 3-5 most important file paths for this module
-
-Do not guess. Prioritize accuracy.
-
-Respond ONLY with valid JSON:
-{{
-  "project_summary": "...",
-  "tech_stack": {{
-    "language": "...",
-    "framework_backend": "...",
-    "framework_frontend": "...",
-    "database": "...",
-    "key_libraries": ["..."]
-  }},
-  "architecture_overview": "...",
-  "key_modules": [
-    {{
-      "module_name": "...",
-      "description": "...",
-      "relevant_files": ["..."]
-    }}
-  ]
-}}"""
+        prompt = DEEP_CONTEXT_PROMPT.substitute(
+            directory_overview=directory_overview, file_list_str=file_list_str, readme_content=readme_content
+        )
         
         logger.info("🚀 Calling Gemini for deep analysis...")
-        api_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent'
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            params={'key': GEMINI_API_KEY},
-            json={
-                'contents': [{'parts': [{'text': prompt}]}],
-                'generationConfig': {'temperature': 0.1, 'maxOutputTokens': 4096}
-            },
-            timeout=30
+        project_context = call_gemini(
+            prompt, {'temperature': 0.1, 'maxOutputTokens': 4096}, timeout=30, context="deep analysis",
+            stream_json=True, parse=lambda text: parse_json_from_text(text, "deep analysis")
         )
-        
-        data = response.json()
-        logger.info(f"📦 Gemini Response Keys: {list(data.keys())}")
-        
-        # Check for errors in response
-        if 'error' in data:
-            error_msg = data['error'].get('message', 'Unknown error')
-            logger.error(f"❌ Gemini API Error: {error_msg}")
-            raise Exception(f"Gemini API error: {error_msg}")
-        
-        # Check if candidates exist
-        if 'candidates' not in data or not data['candidates']:
-            logger.error(f"❌ No candidates in deep analysis response: {json.dumps(data)}")
-            if 'promptFeedback' in data:
-                feedback = data['promptFeedback']
-                logger.error(f"⚠️ Prompt Feedback: {json.dumps(feedback)}")
-            raise Exception("Gemini API returned no candidates for deep analysis")
-        
-        text = data['candidates'][0]['content']['parts'][0]['text']
-        logger.info(f"📝 Deep Analysis Response: {text[:500]}...")
-        
-        project_context = parse_json_from_text(text, "deep analysis")
         logger.info("✅ Deep analysis complete!")
         logger.info(f"📊 Found {len(project_context.get('key_modules', []))} key modules")
         
@@ -461,6 +897,9 @@ Respond ONLY with valid JSON:
         except Exception as save_error:
             logger.error(f"⚠️ Failed to save repo context (non-critical): {str(save_error)}")
         
+        with _repo_context_cache_lock:
+            _repo_context_cache[cache_key] = project_context
+        
         return project_context
         
     except Exception as e:
@@ -474,8 +913,12 @@ def analyze_github_repo(repo_url, github_token=None):
     owner, repo = parts[-2], parts[-1]
     return create_deep_project_context(owner, repo, github_token)
 
-def generate_implementation_plan(task, answers=None, session_id=None, team_members=None):
-    """Phase 2: Generate detailed implementation plan based on task type and codebase findings"""
+def generate_implementation_plan(task, answers=None, session_id=None, team_members=None, use_cache=True):
+    """Phase 2: Generate detailed implementation plan based on task type and codebase findings.
+
+    Pass use_cache=False to always ask Gemini for a fresh plan; it replaces
+    the cached one for later requests.
+    """
     logger.info("="*60)
     logger.info("STEP 2: IMPLEMENTATION PLAN GENERATION")
     logger.info("="*60)
@@ -486,9 +929,9 @@ def generate_implementation_plan(task, answers=None, session_id=None, team_membe
     # Get task analysis from session
     task_type = "new"
     codebase_findings = []
-    if session_id and session_id in task_sessions:
-        session = task_sessions[session_id]
-        analysis = session.get('analysis', {})
+    session = load_task_session(session_id) if session_id else None
+    if session:
+        analysis = session.get('analysis') or {}
         task_type = analysis.get('task_type', 'new')
         codebase_findings = analysis.get('codebase_findings', [])
         logger.info(f"📂 Task Type: {task_type}")
@@ -505,95 +948,41 @@ def generate_implementation_plan(task, answers=None, session_id=None, team_membe
             [f"- {f['file']}" for f in codebase_findings[:5]]
         )
     
-    prompt = f"""You are a senior project manager. Create a detailed implementation plan.
-
-Task: "{task}"
-Task Type: {task_type.upper()}
-{f"\nClarifications:\n{answers_text}" if answers_text else ""}
-{findings_text}
-
-Instructions:
-- If task type is "new": Create plan for building from scratch
-- If task type is "update": Focus on modifying existing code in the files listed
-- If task type is "both": Plan for both new features and modifications
-
-Create 5-7 specific subtasks with:
-- Clear, actionable title
-- Detailed description
-- Suggested role (Frontend Dev, Backend Dev, Designer, etc.)
-- Realistic deadline (Day 1, Day 2, etc.)
-- Expected output/deliverable
-- Clarity score (0-100)
-
-Return ONLY valid JSON:
-{{
-  "main_task": "Task Title",
-  "goal": "What we're achieving",
-  "task_type": "{task_type}",
-  "subtasks": [
-    {{
-      "title": "Subtask name",
-      "description": "Detailed steps",
-      "assigned_to": "Role",
-      "deadline": "Day X",
-      "output": "Deliverable",
-      "clarity_score": 95
-    }}
-  ]
-}}"""
+    clarifications_text = f"\nClarifications:\n{answers_text}" if answers_text else ""
+    
+    prompt = PLAN_PROMPT.substitute(
+        task=task, task_type=task_type.upper(), clarifications_text=clarifications_text, findings_text=findings_text
+    )
 
+    # Only reuse plans within the session that produced them
+    cache_namespace = None
+    if session_id:
+        raw = f"{session_id}|{task_type}|{clarifications_text}|{findings_text}"
+        cache_namespace = hashlib.sha256(raw.encode()).hexdigest()
+    if use_cache and cache_namespace:
+        cached = _plan_semantic_cache.lookup(cache_namespace, task)
+        if cached is not None:
+            logger.info("⚡ Reusing plan for a near-identical task in this session")
+            add_to_history(session_id, task, plan=cached)
+            return cached
+    
     try:
         logger.info("🚀 Calling Gemini API for implementation plan...")
-        api_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent'
-        
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            params={'key': GEMINI_API_KEY},
-            json={
-                'contents': [{'parts': [{'text': prompt}]}],
-                'generationConfig': {'temperature': 0.6, 'maxOutputTokens': 2048}
-            },
-            timeout=20
+        result = call_gemini(
+            prompt, {'temperature': 0.6, 'maxOutputTokens': 2048}, timeout=20, context="plan generation",
+            use_cache=use_cache, stream_json=True, parse=lambda text: parse_json_from_text(text, "plan generation")
         )
-        
-        data = response.json()
-        logger.info(f"✅ Gemini Response Status: {response.status_code}")
-        logger.info(f"📦 Response Keys: {list(data.keys())}")
-        
-        # Check for errors in response
-        if 'error' in data:
-            error_msg = data['error'].get('message', 'Unknown error')
-            logger.error(f"❌ Gemini API Error: {error_msg}")
-            raise Exception(f"Gemini API error: {error_msg}")
-        
-        # Check if candidates exist
-        if 'candidates' not in data or not data.get('candidates'):
-            logger.error(f"❌ No candidates in plan generation response: {json.dumps(data)}")
-            if 'promptFeedback' in data:
-                feedback = data['promptFeedback']
-                logger.error(f"⚠️ Prompt Feedback: {json.dumps(feedback)}")
-                if 'blockReason' in feedback:
-                    raise Exception(f"Content blocked: {feedback['blockReason']}")
-            raise Exception("Gemini API returned no candidates for plan generation")
-        
-        text = data['candidates'][0]['content']['parts'][0]['text']
-        logger.info(f"📝 Plan Response Preview: {text[:200]}...")
-        
-        result = parse_json_from_text(text, "plan generation")
         logger.info(f"✨ Plan Generated: {len(result.get('subtasks', []))} subtasks")
         logger.info("="*60)
         logger.info(f"✅ PLAN COMPLETE")
         logger.info("="*60)
         
+        if cache_namespace:
+            _plan_semantic_cache.add(cache_namespace, task, result)
+        
         # Add plan to conversation history in database
         if session_id:
-            try:
-                # Save to database with plan included
-                save_conversation_history(session_id, task, analysis=None, plan=result)
-                logger.info(f"💾 Added plan to database history")
-            except Exception as e:
-                logger.error(f"❌ Error saving plan to history: {str(e)}")
+            add_to_history(session_id, task, plan=result)
         
         return result
             
@@ -619,64 +1008,17 @@ def summarize_slack_messages(messages):
     
     try:
         # Prepare messages for AI
-        conversation_text = ""
-        for msg in messages:
-            user = msg.get('user', 'Unknown')
-            text = msg.get('text', '')
-            conversation_text += f"{user}: {text}\n"
+        conversation_text = build_slack_transcript(messages)
         
-        prompt = f"""Analyze the following Slack channel conversation and provide a concise summary.
-
-SLACK MESSAGES:
-{conversation_text}
-
-Generate a JSON response with this structure:
-{{
-  "key_updates": [
-    {{"user": "User Name", "update": "Brief description of what they said/did"}},
-    ...
-  ],
-  "active_users": ["List of users who participated"],
-  "blockers": ["Any blockers or issues mentioned"],
-  "progress_indicators": ["Any progress updates or completed tasks"],
-  "overall_status": "A one-sentence summary of the channel activity",
-  "sentiment": "positive/neutral/negative",
-  "action_items": ["Any action items or next steps mentioned"]
-}}
-
-Keep updates brief (max 15 words each). Return ONLY valid JSON, no markdown, no code blocks."""
+        prompt = SLACK_SUMMARY_PROMPT.substitute(conversation_text=conversation_text)
         
         logger.info("🚀 Calling Gemini API for summary...")
-        api_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent'
-        
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            params={'key': GEMINI_API_KEY},
-            json={
-                'contents': [{'parts': [{'text': prompt}]}],
-                'generationConfig': {
-                    'temperature': 0.3,
-                    'topK': 40,
-                    'topP': 0.95,
-                    'maxOutputTokens': 2048
-                }
-            },
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Gemini API returned status {response.status_code}")
-        
-        response_data = response.json()
-        
-        if 'candidates' not in response_data:
-            raise Exception("No candidates in Gemini response")
-        
-        text = response_data['candidates'][0]['content']['parts'][0]['text']
-        logger.info(f"📝 Summary Response Preview: {text[:200]}...")
-        
-        result = parse_json_from_text(text, "slack summary")
+        result = call_gemini(prompt, {
+            'temperature': 0.3,
+            'topK': 40,
+            'topP': 0.95,
+            'maxOutputTokens': 2048
+        }, timeout=30, context="slack summary", parse=lambda text: parse_json_from_text(text, "slack summary"))
         logger.info(f"✨ Summary Generated Successfully")
         logger.info("="*60)
         
@@ -1,33 +1,336 @@
-import os
-import requests
 import logging
-import json
 import re
+import time
+import random
+import hashlib
+import threading
+from itertools import islice
+from collections import Counter
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from cachetools import TTLCache
+from urllib3.util.retry import Retry
+from app.utils.http import create_session, DEFAULT_TIMEOUT
+from app.database.redis_client import get_redis
+from app.services.ai_service import call_gemini
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(name)s] - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# Manifest/config files worth naming in the structure prompt
+_KEY_FILE_RE = re.compile(r'package\.json|requirements\.txt|README|Dockerfile|\.env')
+
+# README boilerplate dropped before it reaches the prompt: images/badges,
+# inline HTML and fenced code (install snippets, examples)
+_README_NOISE_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)|<[^>]+>|```.*?```', re.S)
+_README_HEADING_RE = re.compile(r'^#{1,6}\s+', re.M)
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+README_PROMPT_CHARS = 1200
+
+# Page number of the rel="last" entry in a GitHub Link header
+_LAST_PAGE_RE = re.compile(r'[?&]page=(\d+)>; rel="last"')
+
+# Fields copied from each /user/repos entry, and the keys they're returned under
+_REPO_FIELDS = itemgetter('name', 'full_name', 'html_url', 'description', 'language', 'updated_at')
+_REPO_KEYS = ('name', 'full_name', 'url', 'description', 'language', 'updated_at')
+
+# Upper bound on /user/repos pages (100 repos each) fetched per call
+MAX_REPO_PAGES = 10
+
+# Default branch name and head commit in one round trip
+_REPO_HEAD_QUERY = """query($owner: String!, $name: String!) {
+  repository(owner: $owner, name: $name) {
+    defaultBranchRef { name target { oid } }
+  }
+}"""
+
+# Keep-alive pool for api.github.com; transient 5xx are retried here, while
+# rate limits (403/429, Retry-After) are left to github_request, which caps
+# how long a request thread may wait on them
+_github = create_session(pool_connections=32, pool_maxsize=64, retries=Retry(
+    total=3,
+    backoff_factor=0.3,
+    status_forcelist=[500, 502, 503, 504],
+    respect_retry_after_header=False,
+    raise_on_status=False,
+    # The only POST sent here is the read-only GraphQL head query, so it is
+    # as safe to retry as the GETs
+    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {'POST'}
+))
+
+# Epoch second until which a token must not call GitHub, learned from
+# X-RateLimit-* and Retry-After headers. Tracked per token: user tokens are
+# never pooled, since each one only grants access to its owner's repos.
+_token_cooldowns = TTLCache(maxsize=5000, ttl=3600)
+_token_cooldowns_lock = threading.Lock()
+
+# analyze_repo_structure results per (owner, repo, head SHA); a push moves
+# the SHA, so stale structure is never served after the repo changes
+_structure_cache = TTLCache(maxsize=512, ttl=300)
+_structure_cache_lock = threading.Lock()
+
+# Gemini structure summaries per (owner, repo, root tree SHA), shared through
+# Redis when it is configured. A tree SHA pins the exact contents, so entries
+# live a day, and commits that leave the files unchanged reuse them too.
+STRUCTURE_SUMMARY_TTL_SECONDS = 86400
+_summary_cache = TTLCache(maxsize=1024, ttl=STRUCTURE_SUMMARY_TTL_SECONDS)
+_summary_cache_lock = threading.Lock()
+
+# Default branch per (owner, repo); renames are rare, so an hour is plenty
+_default_branch_cache = TTLCache(maxsize=1024, ttl=3600)
+_default_branch_cache_lock = threading.Lock()
+
+# Last ETag and parsed body per (token, url). Revalidating with
+# If-None-Match gets a 304 when nothing changed, and 304s don't count
+# against the rate limit. Keyed by token so one user's private responses
+# are never replayed to another. The budget is in response-body bytes
+# rather than entries, since one recursive tree can run to megabytes and
+# every new commit SHA adds another; the parsed copy held in memory is a
+# few times larger than the raw body.
+ETAG_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_etag_cache = TTLCache(maxsize=ETAG_CACHE_MAX_BYTES, ttl=3600, getsizeof=lambda entry: entry[2])
+_etag_cache_lock = threading.Lock()
+
+# Overlaps independent GitHub reads (e.g. pages of the user's repo list)
+_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gh-fetch")
+
+# Longest wait github_request will absorb before failing fast
+MAX_RATE_LIMIT_WAIT = 5
+
+# GitHub asks for at least a minute's pause after a secondary (abuse) rate
+# limit that comes without Retry-After
+SECONDARY_RATE_LIMIT_WAIT = 60
+
+# Remaining-budget level below which each response is logged as a warning
+RATE_LIMIT_LOW_WATER = 50
+
+
+def _rate_limit_key(github_token):
+    return hashlib.sha256(github_token.encode()).digest()[:16]
+
+
+def _cooldown_until(response):
+    """Epoch second GitHub asked us to wait until, or None"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return time.time() + int(retry_after)
+    remaining = response.headers.get('X-RateLimit-Remaining')
+    if remaining == '0':
+        reset = response.headers.get('X-RateLimit-Reset')
+        if reset and reset.isdigit():
+            return int(reset)
+    if response.status_code in (403, 429) and b'secondary rate limit' in response.content.lower():
+        return time.time() + SECONDARY_RATE_LIMIT_WAIT
+    if remaining and remaining.isdigit() and int(remaining) < RATE_LIMIT_LOW_WATER:
+        logger.warning(f"⚠️ GitHub token has {remaining} requests left until reset")
+    return None
+
+
+def github_request(method, url, github_token, **kwargs):
+    """Call the GitHub API with github_token, respecting its rate limit.
+
+    Once GitHub reports a token as exhausted (or throttled with Retry-After),
+    later calls wait out short cooldowns and fail fast on long ones instead of
+    collecting 403s.
+    """
+    key = _rate_limit_key(github_token)
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Authorization'] = f'token {github_token}'
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    
+    for _ in range(2):
+        with _token_cooldowns_lock:
+            until = _token_cooldowns.get(key)
+        wait = until - time.time() if until else 0
+        if wait > MAX_RATE_LIMIT_WAIT:
+            raise Exception(f"GitHub rate limit exceeded, retry in {int(wait)}s")
+        if wait > 0:
+            # Jitter so threads sharing a token don't all retry on the same tick
+            time.sleep(wait + random.uniform(0, 0.5))
+        
+        response = _github.request(method, url, headers=headers, **kwargs)
+        
+        until = _cooldown_until(response)
+        with _token_cooldowns_lock:
+            if until:
+                _token_cooldowns[key] = until
+            else:
+                _token_cooldowns.pop(key, None)
+        
+        if response.status_code not in (403, 429) or until is None:
+            return response
+        logger.warning(f"⚠️ GitHub rate limited ({response.status_code}) for {url}")
+    
+    return response
+
+
+def github_get_json(url, github_token):
+    """GET a GitHub JSON resource, revalidating any cached copy by ETag.
+
+    Returns (status_code, data); data is None unless the status is 200.
+    A 304 is reported as 200 with the cached body.
+    """
+    key = (_rate_limit_key(github_token), url)
+    with _etag_cache_lock:
+        cached = _etag_cache.get(key)
+    headers = {'If-None-Match': cached[0]} if cached else None
+    
+    resp = github_request('GET', url, github_token, headers=headers)
+    if resp.status_code == 304 and cached:
+        return 200, cached[1]
+    if resp.status_code != 200:
+        return resp.status_code, None
+    
+    data = orjson.loads(resp.content)
+    etag = resp.headers.get('ETag')
+    size = len(resp.content)
+    # A body bigger than a quarter of the budget would flush everything else
+    if etag and size <= ETAG_CACHE_MAX_BYTES // 4:
+        with _etag_cache_lock:
+            _etag_cache[key] = (etag, data, size)
+    return 200, data
+
+
+def _load_structure_summary(key):
+    redis_client = get_redis()
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(f"repo_structure:{key}")
+            if raw is not None:
+                return orjson.loads(raw)
+        except Exception as e:
+            logger.error(f"❌ Redis structure read failed: {str(e)}")
+    with _summary_cache_lock:
+        return _summary_cache.get(key)
+
+
+def _store_structure_summary(key, result):
+    redis_client = get_redis()
+    if redis_client is not None:
+        try:
+            redis_client.setex(f"repo_structure:{key}", STRUCTURE_SUMMARY_TTL_SECONDS, orjson.dumps(result))
+            return
+        except Exception as e:
+            logger.error(f"❌ Redis structure write failed, keeping it in-process: {str(e)}")
+    with _summary_cache_lock:
+        _summary_cache[key] = result
+
+
+def get_head_sha(owner, repo, github_token):
+    """SHA of the default branch's head commit, or None if it can't be read"""
+    url = f"https://api.github.com/repos/{owner}/{repo}/commits/HEAD"
+    # The sha media type returns just the 40-char SHA instead of the commit JSON
+    resp = github_request('GET', url, github_token, headers={'Accept': 'application/vnd.github.sha'})
+    return resp.text.strip() if resp.status_code == 200 else None
+
+
+def get_default_branch(owner, repo, github_token):
+    """Name of the repo's default branch, from cache or GET /repos/{owner}/{repo}"""
+    key = (owner.lower(), repo.lower())
+    with _default_branch_cache_lock:
+        branch = _default_branch_cache.get(key)
+    if branch:
+        return branch
+    
+    status, meta = github_get_json(f"https://api.github.com/repos/{owner}/{repo}", github_token)
+    if status != 200:
+        raise Exception(f"Could not read {owner}/{repo}: GitHub returned {status}")
+    branch = meta['default_branch']
+    with _default_branch_cache_lock:
+        _default_branch_cache[key] = branch
+    return branch
+
+
+def get_repo_head(owner, repo, github_token):
+    """(default branch, head commit SHA) of a repo, or (None, None) if unreadable.
+
+    One GraphQL call answers both; REST is used if GraphQL errors out.
+    """
+    resp = github_request('POST', GITHUB_GRAPHQL_URL, github_token, json={
+        'query': _REPO_HEAD_QUERY,
+        'variables': {'owner': owner, 'name': repo}
+    })
+    if resp.status_code == 200:
+        data = orjson.loads(resp.content)
+        ref = ((data.get('data') or {}).get('repository') or {}).get('defaultBranchRef')
+        if ref and not data.get('errors'):
+            with _default_branch_cache_lock:
+                _default_branch_cache[(owner.lower(), repo.lower())] = ref['name']
+            return ref['name'], ref['target']['oid']
+    logger.warning(f"⚠️ GraphQL head lookup failed for {owner}/{repo} ({resp.status_code}), using REST")
+    
+    head_sha = get_head_sha(owner, repo, github_token)
+    if not head_sha:
+        return None, None
+    return get_default_branch(owner, repo, github_token), head_sha
+
+
+def _blob_paths(tree_data):
+    """File paths in a recursive tree response, generated without building a list"""
+    return (entry['path'] for entry in tree_data.get('tree', []) if entry['type'] == 'blob')
+
+
+def _readme_blob_sha(tree_data):
+    """Blob SHA of the top-level README (README.md preferred), or None"""
+    readmes = [
+        entry for entry in tree_data.get('tree', [])
+        if entry['type'] == 'blob' and '/' not in entry['path'] and entry['path'].lower().startswith('readme')
+    ]
+    readmes.sort(key=lambda entry: not entry['path'].lower().endswith('.md'))
+    return readmes[0]['sha'] if readmes else None
+
+
+def trim_readme(readme, max_chars=README_PROMPT_CHARS):
+    """Condense a README to each section's heading and first two sentences"""
+    lines = [line for line in readme.splitlines() if not line.lstrip().startswith('[![')]
+    text = _README_NOISE_RE.sub('', '\n'.join(lines))
+    
+    parts = []
+    for i, section in enumerate(_README_HEADING_RE.split(text)):
+        # Text before the first heading has no heading line of its own
+        heading, _, body = section.partition('\n') if i else ('', '', section)
+        sentences = _SENTENCE_END_RE.split(' '.join(body.split()), maxsplit=2)[:2]
+        part = '\n'.join(filter(None, [heading.strip(), ' '.join(sentences)]))
+        if part:
+            parts.append(part)
+    return '\n\n'.join(parts)[:max_chars]
+
 
 def get_user_repos(github_token):
     """Fetch user's GitHub repositories"""
     logger.info("🔍 Fetching user repositories...")
     
-    headers = {'Authorization': f'token {github_token}'}
     url = "https://api.github.com/user/repos?per_page=100&sort=updated"
     
     try:
-        response = requests.get(url, headers=headers, timeout=10)
-        data = response.json()
-        
-        repos = [{
-            'name': r['name'],
-            'full_name': r['full_name'],
-            'url': r['html_url'],
-            'description': r['description'],
-            'language': r['language'],
-            'updated_at': r['updated_at']
-        } for r in data if isinstance(data, list)]
+        response = github_request('GET', url, github_token)
+        pages = [orjson.loads(response.content)]
+        
+        # Remaining pages are known from the Link header; fetch them together
+        last_match = _LAST_PAGE_RE.search(response.headers.get('Link', ''))
+        last_page = min(int(last_match.group(1)), MAX_REPO_PAGES) if last_match else 1
+        if last_page > 1:
+            futures = [
+                _fetch_pool.submit(github_request, 'GET', f"{url}&page={page}", github_token)
+                for page in range(2, last_page + 1)
+            ]
+            pages.extend(orjson.loads(future.result().content) for future in futures)
+        
+        repos = []
+        seen = set()
+        for data in pages:
+            if not isinstance(data, list):
+                logger.error(f"❌ Unexpected repos response: {str(data)[:200]}")
+                continue
+            for r in data:
+                # Pages can shift under sort=updated; skip repos already listed
+                if r['full_name'] in seen:
+                    continue
+                seen.add(r['full_name'])
+                repos.append(dict(zip(_REPO_KEYS, _REPO_FIELDS(r))))
         
         logger.info(f"✅ Found {len(repos)} repositories")
         return repos
@@ -39,46 +342,67 @@ def analyze_repo_structure(owner, repo, github_token):
     """Get detailed repo structure and generate AI summary"""
     logger.info(f"📦 Analyzing {owner}/{repo}...")
     
-    headers = {'Authorization': f'token {github_token}'}
-    
     try:
-        # Get repo tree
-        tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/main?recursive=1"
-        tree_resp = requests.get(tree_url, headers=headers, timeout=10)
-        
-        if tree_resp.status_code != 200:
-            tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/master?recursive=1"
-            tree_resp = requests.get(tree_url, headers=headers, timeout=10)
-        
-        tree_data = tree_resp.json()
-        all_files = [f['path'] for f in tree_data.get('tree', []) if f['type'] == 'blob']
-        
-        # Build folder structure
-        folders = {}
-        for file in all_files:
-            parts = file.split('/')
-            if len(parts) > 1:
-                folder = parts[0]
-                folders[folder] = folders.get(folder, 0) + 1
-        
-        # Get README
-        readme_url = f"https://api.github.com/repos/{owner}/{repo}/readme"
-        readme_resp = requests.get(readme_url, headers=headers, timeout=10)
+        # Resolving the head SHA also confirms this token can read the repo,
+        # so cached results are only served to callers with access
+        branch, head_sha = get_repo_head(owner, repo, github_token)
+        cache_key = (owner.lower(), repo.lower(), head_sha)
+        if head_sha:
+            with _structure_cache_lock:
+                cached = _structure_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"⚡ Using cached structure for {owner}/{repo}@{head_sha[:7]}")
+                return cached
+        
+        repo_url = f"https://api.github.com/repos/{owner}/{repo}"
+        
+        # A tree fetched by commit SHA never changes, so its ETag always revalidates
+        tree_ref = head_sha or get_default_branch(owner, repo, github_token)
+        status, tree_data = github_get_json(f"{repo_url}/git/trees/{tree_ref}?recursive=1", github_token)
+        if status != 200:
+            raise Exception(f"Could not read tree for {owner}/{repo}@{branch or tree_ref}: GitHub returned {status}")
+        
+        # Same files as an earlier analysis: reuse its summary, skip Gemini
+        summary_key = f"{owner.lower()}/{repo.lower()}:{tree_data.get('sha')}" if tree_data.get('sha') else None
+        if summary_key:
+            result = _load_structure_summary(summary_key)
+            if result is not None:
+                logger.info(f"⚡ Reusing structure summary for tree {tree_data['sha'][:7]}")
+                if head_sha:
+                    with _structure_cache_lock:
+                        _structure_cache[cache_key] = result
+                return result
+        
+        file_count = sum(1 for _ in _blob_paths(tree_data))
+        
+        # Build folder structure (file count per top-level folder)
+        folders = dict(Counter(
+            path[:i] for path in _blob_paths(tree_data) if (i := path.find('/')) > 0
+        ))
+        
+        key_files = list(islice(filter(_KEY_FILE_RE.search, _blob_paths(tree_data)), 10))
+        
+        # Get README by its blob SHA from the tree; repos without one skip the call
         readme = ""
-        if readme_resp.status_code == 200:
+        readme_sha = _readme_blob_sha(tree_data)
+        status, readme_data = github_get_json(f"{repo_url}/git/blobs/{readme_sha}", github_token) if readme_sha else (404, None)
+        if status == 200:
             import base64
-            readme = base64.b64decode(readme_resp.json()['content']).decode('utf-8')[:3000]
+            readme = trim_readme(base64.b64decode(readme_data['content']).decode('utf-8', errors='replace'))
         
-        # Generate AI summary
+        # Generate AI summary; the repo facts go in as one compact JSON object
+        repo_facts = orjson.dumps({
+            'repo': f"{owner}/{repo}",
+            'total_files': file_count,
+            'folder_count': len(folders),
+            'folders': list(folders)[:20],
+            'key_files': key_files,
+            'readme': readme
+        }).decode()
         prompt = f"""Analyze this GitHub repository structure and provide a detailed summary.
 
-Repository: {owner}/{repo}
-Total Files: {len(all_files)}
-Main Folders: {', '.join(list(folders.keys())[:20])}
-Key Files: {', '.join([f for f in all_files if any(x in f for x in ['package.json', 'requirements.txt', 'README', 'Dockerfile', '.env'])][:10])}
-
-README Content:
-{readme[:1500]}
+Repository facts (JSON):
+{repo_facts}
 
 Provide JSON:
 {{
@@ -93,29 +417,22 @@ Provide JSON:
 }}"""
         
         logger.info("🤖 Calling Gemini for analysis...")
-        api_url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent'
-        response = requests.post(
-            api_url,
-            headers={'Content-Type': 'application/json'},
-            params={'key': GEMINI_API_KEY},
-            json={
-                'contents': [{'parts': [{'text': prompt}]}],
-                'generationConfig': {'temperature': 0.4, 'maxOutputTokens': 2048}
-            },
-            timeout=25
-        )
-        
-        data = response.json()
-        
-        if 'candidates' in data and data['candidates']:
-            text = data['candidates'][0]['content']['parts'][0]['text']
-            json_match = re.search(r'\{[\s\S]*\}', text)
-            if json_match:
-                result = json.loads(json_match.group())
-                result['total_files'] = len(all_files)
-                result['folders'] = folders
-                logger.info("✅ Analysis complete")
-                return result
+        # JSON mode returns the bare object; streaming stops as soon as it closes
+        result = call_gemini(prompt, {
+            'temperature': 0.4,
+            'maxOutputTokens': 2048,
+            'responseMimeType': 'application/json'
+        }, timeout=25, context="repo structure", stream_json=True, parse=orjson.loads)
+        if isinstance(result, dict):
+            result['total_files'] = file_count
+            result['folders'] = folders
+            if head_sha:
+                with _structure_cache_lock:
+                    _structure_cache[cache_key] = result
+            if summary_key:
+                _store_structure_summary(summary_key, result)
+            logger.info("✅ Analysis complete")
+            return result
         
         raise Exception("Failed to parse Gemini response")
         
@@ -0,0 +1,85 @@
+"""
+Background Jobs
+Run slow LLM work off the request thread and let clients poll for the result
+"""
+import json
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from app.database.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs stay pollable for an hour
+JOB_TTL_SECONDS = 3600
+
+# Dedicated pool so long LLM jobs don't starve the shared background writes
+_job_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="jobs")
+
+# Job state by id; kept in Redis instead when it is configured, so a poll can
+# be answered by any worker
+_jobs = TTLCache(maxsize=10000, ttl=JOB_TTL_SECONDS)
+# Unfinished job id per coalesce key, so identical submissions share one run
+_pending = {}
+_lock = threading.Lock()
+
+
+def _store(job):
+    redis_client = get_redis()
+    if redis_client is not None:
+        try:
+            redis_client.setex(f"job:{job['id']}", JOB_TTL_SECONDS, json.dumps(job, default=str))
+            return
+        except Exception as e:
+            logger.error(f"❌ Redis job write failed, keeping it in-process: {str(e)}")
+    with _lock:
+        _jobs[job['id']] = job
+
+
+def get_job(job_id):
+    """Get a job's state dict (id, owner, status, result, error), or None"""
+    redis_client = get_redis()
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(f"job:{job_id}")
+            if raw is not None:
+                return json.loads(raw)
+        except Exception as e:
+            logger.error(f"❌ Redis job read failed: {str(e)}")
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _run(job, coalesce_key, fn, args):
+    try:
+        job = {**job, "status": "done", "result": fn(*args)}
+    except Exception as e:
+        logger.error(f"❌ Job {job['id']} failed: {str(e)}")
+        job = {**job, "status": "failed", "error": str(e)}
+    _store(job)
+    if coalesce_key is not None:
+        with _lock:
+            _pending.pop(coalesce_key, None)
+
+
+def submit_job(owner, fn, *args, coalesce_key=None):
+    """Queue fn(*args) and return its job id right away.
+
+    owner is recorded so only the submitting user can poll the job. A
+    submission whose coalesce_key matches an unfinished job gets that job's
+    id instead of starting another run.
+    """
+    with _lock:
+        if coalesce_key is not None and coalesce_key in _pending:
+            return _pending[coalesce_key]
+        job_id = uuid.uuid4().hex
+        if coalesce_key is not None:
+            _pending[coalesce_key] = job_id
+
+    job = {"id": job_id, "owner": owner, "status": "pending", "result": None, "error": None}
+    _store(job)
+    _job_pool.submit(_run, job, coalesce_key, fn, args)
+    logger.info(f"📬 Queued job {job_id}")
+    return job_id
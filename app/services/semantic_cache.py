@@ -0,0 +1,83 @@
+"""
+Semantic Response Cache
+In-process near-duplicate lookup for LLM responses, keyed by task wording
+"""
+import re
+import threading
+from collections import OrderedDict, deque
+from difflib import SequenceMatcher
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Filler that never changes what a task asks for. Prepositions and verbs are
+# kept: "migrate A to B" and "add X" mean something else with them swapped.
+_FILLER = frozenset({"a", "an", "the", "please"})
+
+
+def _tokenize(text):
+    """Lowercased word sequence of text, in order, without filler words"""
+    return tuple(t for t in _TOKEN_RE.findall(text.lower()) if t not in _FILLER)
+
+
+class SemanticCache:
+    """Return a stored payload when a new text is close enough to a cached one.
+
+    Texts are compared as ordered word sequences, so reordered or
+    reversed wordings don't match. The default threshold of 1.0 only
+    reuses a payload for the same words in the same order, ignoring case,
+    punctuation and filler words. Lower thresholds use the difflib ratio
+    of the two sequences; keep them high, since a single swapped verb
+    in a long task still scores close to 1.
+
+    Entries are grouped by namespace (e.g. the repo) so a task is only
+    matched against tasks asked about the same codebase. Each namespace
+    keeps its most recent max_entries texts; the least recently used
+    namespaces are dropped past max_namespaces.
+    """
+
+    def __init__(self, threshold=1.0, max_entries=200, max_namespaces=1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_namespaces = max_namespaces
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, namespace, text):
+        """Get the payload of the most similar cached text, or None"""
+        tokens = _tokenize(text)
+        if not tokens:
+            return None
+
+        with self._lock:
+            entries = self._entries.get(namespace)
+            if not entries:
+                return None
+            self._entries.move_to_end(namespace)
+            candidates = list(entries)
+
+        best_score, best_payload = 0.0, None
+        for cached_tokens, payload in reversed(candidates):
+            if cached_tokens == tokens:
+                return payload
+            if self.threshold < 1.0:
+                score = SequenceMatcher(None, tokens, cached_tokens, autojunk=False).ratio()
+                if score > best_score:
+                    best_score, best_payload = score, payload
+
+        return best_payload if best_score >= self.threshold else None
+
+    def add(self, namespace, text, payload):
+        """Remember payload as the response for text"""
+        tokens = _tokenize(text)
+        if not tokens:
+            return
+
+        with self._lock:
+            entries = self._entries.get(namespace)
+            if entries is None:
+                entries = self._entries[namespace] = deque(maxlen=self.max_entries)
+                if len(self._entries) > self.max_namespaces:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(namespace)
+            entries.append((tokens, payload))
@@ -0,0 +1,42 @@
+"""
+Single-Flight Call Coalescing
+Concurrent callers asking for the same key share one in-flight computation
+"""
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Run fn at most once per key at a time.
+
+    The first caller for a key (the leader) runs fn; callers that arrive
+    while it's running block on the same Future and receive its result or
+    exception. Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return (result, shared); shared is True for callers that waited on a leader"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
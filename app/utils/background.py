@@ -0,0 +1,27 @@
+"""
+Background Executor
+Shared thread pool for fire-and-forget work that shouldn't block a response
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bg")
+
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error("❌ Background task failed: %s", exc)
+
+
+def run_in_background(fn, *args, **kwargs):
+    """Submit fn to the shared pool and return its Future.
+
+    Exceptions are logged when the task finishes, so callers that never
+    wait on the Future don't lose them silently.
+    """
+    future = _executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(_log_failure)
+    return future
@@ -0,0 +1,30 @@
+"""
+Blueprint Error Handlers
+Shared JSON error responses so routes don't each repeat a try/except tail
+"""
+import logging
+import jwt
+from flask import jsonify, request
+from werkzeug.exceptions import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+def register_error_handlers(bp):
+    """Attach the standard JWT and catch-all handlers to a blueprint"""
+
+    @bp.errorhandler(jwt.ExpiredSignatureError)
+    def handle_expired_token(e):
+        return jsonify({"error": "Token expired"}), 401
+
+    @bp.errorhandler(jwt.InvalidTokenError)
+    def handle_invalid_token(e):
+        return jsonify({"error": "Invalid token"}), 401
+
+    @bp.errorhandler(Exception)
+    def handle_exception(e):
+        # Let aborts and bad-request errors keep their own status codes
+        if isinstance(e, HTTPException):
+            return e
+        logger.error("❌ Error in %s: %s", request.endpoint, e)
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,32 @@
+"""
+HTTP Client Utilities
+Pooled requests sessions for outbound API calls
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connecting should take well under this; a DNS or TLS stall fails fast
+# instead of using up the whole read budget
+CONNECT_TIMEOUT = 3.05
+
+# (connect, read) timeout so a stalled upstream host can't wedge a worker
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, 10)
+
+
+def create_session(pool_connections=10, pool_maxsize=50, retries=None):
+    """Create a keep-alive requests.Session with a pooled HTTPS adapter.
+
+    Connections (and their TLS sessions) are reused across calls, so only
+    the first request to a host pays for the handshake.
+    """
+    if retries is None:
+        retries = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retries
+    ))
+    return session
@@ -0,0 +1,49 @@
+"""
+orjson JSON Provider
+Drop-in replacement for Flask's default JSON provider (encode and decode)
+"""
+import orjson
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+# Datetimes go through Flask's default hook so responses keep the same
+# HTTP-date format; non-str keys are stringified like the stdlib encoder does
+_DUMP_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+# Body of the {"ok": true} acknowledgement, serialized once
+OK_BODY = orjson.dumps({"ok": True})
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serialize with orjson, falling back to Flask's encoder for other types"""
+
+    def dumpb(self, obj):
+        """Serialize obj straight to bytes"""
+        option = _DUMP_OPTIONS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj).decode()
+
+    def loads(self, s, **kwargs):
+        """Parse request bodies with orjson.
+
+        orjson.JSONDecodeError subclasses ValueError, so request.get_json
+        still turns malformed bodies into a 400 (or None with silent=True).
+        """
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj), mimetype=self.mimetype)
+
+
+def ok_response():
+    """Build an {"ok": true} response from the pre-serialized body.
+
+    A fresh Response is returned each time since after_request hooks
+    mutate headers; only the serialization is shared.
+    """
+    return current_app.response_class(OK_BODY, mimetype='application/json')
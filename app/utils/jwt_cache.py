@@ -0,0 +1,112 @@
+"""
+JWT Verification Cache
+Memoizes decoded JWT payloads so repeat requests skip HMAC verification
+"""
+import os
+import time
+import hashlib
+import threading
+from functools import wraps
+import jwt
+from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from flask import request, jsonify, g
+
+JWT_SECRET = os.getenv('FLASK_SECRET', 'change_this_secret')
+JWT_ALGORITHMS = ["HS256"]
+
+# Reused PyJWT instance; tokens without exp or user_id are rejected up front
+_jwt = jwt.PyJWT(options={"verify_signature": True, "require": ["exp", "user_id"]})
+
+# Verified payloads, keyed by a digest of the raw token
+_cache = TTLCache(maxsize=10000, ttl=30)
+# Tokens that failed verification, kept briefly so tight retry loops stay cheap
+_invalid_cache = TTLCache(maxsize=10000, ttl=5)
+_lock = threading.Lock()
+
+
+def _cache_key(token):
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+
+def extract_bearer(req):
+    """Get the raw token from a request's Authorization header, or None"""
+    header = req.headers.get('Authorization')
+    if not header:
+        return None
+    return header[7:] if header.startswith('Bearer ') else header
+
+
+def verify_jwt_cached(token):
+    """Decode and verify a JWT, reusing the result for up to 30 seconds.
+
+    Raises the same jwt exceptions as jwt.decode so callers keep their
+    existing error handling.
+    """
+    key = _cache_key(token)
+
+    with _lock:
+        payload = _cache.get(key)
+        invalid = key in _invalid_cache
+
+    if invalid:
+        raise jwt.InvalidTokenError("Invalid token")
+
+    if payload is not None:
+        # Never serve a payload past its own expiry
+        exp = payload.get('exp')
+        if exp is None or exp > time.time():
+            return payload
+        with _lock:
+            _cache.pop(key, None)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+
+    try:
+        payload = _jwt.decode(token, JWT_SECRET, algorithms=JWT_ALGORITHMS)
+        # Parse the user id once; cache hits reuse the ObjectId
+        payload['_oid'] = ObjectId(payload['user_id'])
+    except jwt.ExpiredSignatureError:
+        raise
+    except (jwt.InvalidTokenError, InvalidId, TypeError) as e:
+        with _lock:
+            _invalid_cache[key] = True
+        if isinstance(e, jwt.InvalidTokenError):
+            raise
+        raise jwt.InvalidTokenError("Invalid user id in token") from e
+
+    with _lock:
+        _cache[key] = payload
+    return payload
+
+
+def authenticate_request():
+    """Verify the current request's bearer token and set g.user_id / g.user_oid.
+
+    Returns None on success, or an error response tuple to send back.
+    """
+    token = extract_bearer(request)
+    if not token:
+        return jsonify({"error": "No authorization provided"}), 401
+    
+    try:
+        payload = verify_jwt_cached(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"error": "Token expired"}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid token"}), 401
+    
+    g.user_id = payload['user_id']
+    g.user_oid = payload['_oid']
+    return None
+
+
+def require_auth(f):
+    """Route decorator that runs authenticate_request before the view"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        error = authenticate_request()
+        if error is not None:
+            return error
+        return f(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,50 @@
+"""
+Queued Logging
+Hands log records to a background thread so request threads never block on stdout
+"""
+import os
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+_handler = None
+_listener = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueue records as-is; formatting happens on the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+
+def _start_listener(stream_handler):
+    global _listener
+    _handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def configure_logging(level=logging.INFO, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s'):
+    """Route the root logger through a queue drained by a background thread.
+
+    Safe to call more than once. The listener thread doesn't survive fork,
+    so forked workers (e.g. gunicorn --preload) start their own.
+    """
+    global _handler
+    if _handler is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(fmt))
+
+    _handler = _DeferredQueueHandler(queue.SimpleQueue())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+
+    _start_listener(stream_handler)
+    os.register_at_fork(after_in_child=lambda: _start_listener(stream_handler))
+
+    atexit.register(lambda: _listener.stop())
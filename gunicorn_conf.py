@@ -0,0 +1,19 @@
+"""
+Gunicorn Configuration
+Production server settings: gunicorn -c gunicorn_conf.py "app:create_app()"
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# Almost every request spends its time waiting on GitHub, Slack, Gemini or
+# MongoDB, so gevent workers multiplex many of them per process; gunicorn
+# monkey-patches the worker, which makes requests and pymongo cooperative
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "100"))
+
+# Analyses can wait on Gemini for tens of seconds
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
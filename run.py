@@ -3,17 +3,20 @@
 Feeta Backend Server
 Main entry point for the application
 """
+import os
 from app import create_app
 
 # Create Flask app using factory pattern
 app = create_app()
 
 if __name__ == "__main__":
-    # Run with HTTPS for Slack OAuth
-    # For production, use a proper WSGI server like Gunicorn
+    # Debugger and a self-signed certificate (for Slack OAuth over HTTPS)
+    # only in development; production runs under gunicorn_conf.py
+    dev = os.getenv("FLASK_ENV") == "development"
     app.run(
         host="0.0.0.0",
-        port=5000,
-        debug=True,
-        ssl_context='adhoc'  # Self-signed certificate for development
+        port=int(os.getenv("PORT", "5000")),
+        debug=dev,
+        ssl_context='adhoc' if dev else None,
+        threaded=True
     )